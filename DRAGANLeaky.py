@@ -5,6 +5,7 @@ import os
 import shutil
 import sys
 import random
+import time
 import torch
 import torch.nn as nn
 import torch.nn.parallel
@@ -15,14 +16,15 @@ import torch.utils.data
 import torchvision.datasets as datasets
 import torchvision.transforms as transforms
 import torchvision.utils as vutils
-import torch.distributions as distr
 import models._DRAGAN as dcgm
+import modules.ModuleRedefinitions as nnrd
 import utils.utils as utils
+import utils.distributed as distributed
+import utils.tuning as tuning
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
+from utils.checkpoint import CheckpointWriter, ResumableRandomSampler, get_rng_state, set_rng_state
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 
 # add parameters
@@ -51,11 +53,16 @@ parser.add_argument('--d_lambda', help='Factor for gradient penalty, default=10'
 parser.add_argument('--cuda', help='number of GPU', type=int, default=0)
 parser.add_argument('--gp', help='Use gradient penalty', action='store_true')
 parser.add_argument('--cont', help='Continue training -> Does not delete dir', default=None, type=int)
+parser.add_argument('--resume', help='Path to a training state to resume from, implies not deleting dir', default=None)
+parser.add_argument('--state_interval', help='Minutes between mid-epoch training state saves', type=float, default=5)
 parser.add_argument('--split', help='Split dataset in training and test set', action='store_true')
 parser.add_argument('--comment', help='Comment to add to run parameter file', default='', required=True)
 parser.add_argument('--add_noise', help='Use additive noise to stabilize trainint', action='store_true')
+parser.add_argument('--dist_backend', help='torch.distributed backend when started with torchrun', default='gloo')
 
 opt = parser.parse_args()
+# one process per torchrun worker, only the first one writes outputs
+rank, world_size = distributed.init(opt.dist_backend)
 outf = '{}/{}/{}_{}'.format(opt.outf, os.path.splitext(os.path.basename(sys.argv[0]))[0], opt.dataset, opt.comment)
 checkpointdir = '{}/{}'.format(outf, 'checkpoints')
 ngpu = int(opt.ngpu)
@@ -74,29 +81,30 @@ if opt.fepochs:
 else:
     freezeEpochs = opt.epochs // 3
 
-if not opt.cont:
+if rank == 0:
+    if not opt.cont and not opt.resume:
+        try:
+            shutil.rmtree(outf)
+        except OSError:
+            pass
     try:
-        shutil.rmtree(outf)
+        os.makedirs(outf)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    try:
+        os.makedirs(checkpointdir)
     except OSError:
         pass
-try:
-    os.makedirs(outf)
-except OSError as e:
-    if e.errno != errno.EEXIST:
-        raise
-
-try:
-    os.makedirs(checkpointdir)
-except OSError:
-    pass
 
-text_file = open("{}/run_parameters.txt".format(outf), "w+")
-text_file.write("Run parameters: %s" % opt)
-text_file.close()
+    text_file = open("{}/run_parameters.txt".format(outf), "w+")
+    text_file.write("Run parameters: %s" % opt)
+    text_file.close()
 
 # CUDA everything
 cudnn.benchmark = True
-gpu = torch.device('cuda:{}'.format(opt.cuda) if torch.cuda.is_available() else 'cpu')
+gpu = torch.device('cuda:{}'.format(opt.cuda + distributed.local_rank()) if torch.cuda.is_available() else 'cpu')
 torch.set_default_dtype(torch.float32)
 if torch.cuda.is_available():
     torch.set_default_tensor_type('torch.cuda.FloatTensor')
@@ -139,38 +147,18 @@ if opt.split:
     test_set = torch.utils.data.dataset.Subset(dataset, idx_test)
     dataset = trainingset
 
+# all processes shuffle with the seed of the first one and draw disjoint shares of every epoch
+sampler_seed = distributed.broadcast(random.randrange(2 ** 31))
+if world_size > 1:
+    sampler = distributed.ResumableDistributedSampler(dataset, seed=sampler_seed)
+else:
+    sampler = ResumableRandomSampler(dataset, seed=sampler_seed)
 dataloader = torch.utils.data.DataLoader(dataset, batch_size=opt.batchSize,
-                                         shuffle=True, num_workers=2)
+                                         sampler=sampler, num_workers=2)
 
 
 # misc. helper functions
 
-def draw_chisquare(size):
-    chi_distr = distr.Chi2(1.0)
-    samples = chi_distr.sample((size,))
-    return samples
-
-
-def added_gaussian_chi(ins, stddev):
-    if stddev > 0:
-        noise = torch.Tensor(torch.randn(ins.size()).to(gpu) * stddev)
-        chi = draw_chisquare(ins.size(0)).to(gpu)
-        chi_scaled_noise = noise * chi.reshape(-1, 1, 1, 1)
-        return ins + chi_scaled_noise
-    return ins
-
-
-def added_gaussian(ins, stddev):
-    if stddev > 0:
-        noise = torch.Tensor(torch.randn(ins.size()).to(gpu) * stddev)
-        return ins + noise
-    return ins
-
-
-def adjust_variance(variance, initial_variance, num_updates):
-    return max(variance - initial_variance / num_updates, 0)
-
-
 def soft_real_label(size):
     """
     Tensor containing soft labels, with shape = size
@@ -252,6 +240,19 @@ if opt.eps_init:
 
     discriminator.apply(eps_init)
 
+# threads, oneDNN and memory format of the cpu profile of this machine, see utils/tuning.py
+if not torch.cuda.is_available():
+    tuning.apply_profile('train', generator, discriminator, processes=distributed.local_world_size())
+
+# data parallel training, batch norm layers use the statistics of the batches of all processes, so the running
+# statistics and with them the folded canonical discriminator are the same in every process
+train_generator, train_discriminator = generator, discriminator
+if world_size > 1:
+    nnrd.sync_batch_norm(generator)
+    nnrd.sync_batch_norm(discriminator)
+    train_generator = nn.parallel.DistributedDataParallel(generator, broadcast_buffers=False)
+    train_discriminator = nn.parallel.DistributedDataParallel(discriminator, broadcast_buffers=False)
+
 # init optimizer + loss
 
 d_optimizer = optim.Adam(discriminator.parameters(), lr=float(opt.lr_d), betas=(0.5, 0.999))
@@ -263,19 +264,68 @@ loss = nn.BCELoss()
 
 fixed_noise = torch.randn(1, nz, 1, 1, device=gpu)
 
-# Additive noise to stabilize Training for DCGAN
+# Additive noise to stabilize Training for DCGAN, chi-square scaled and annealed to 0 over a quarter of the updates
 initial_additive_noise_var = 0.1
-add_noise_var = 0.1
+noise_injection = nnrd.NoiseInjection(initial_additive_noise_var, chi=True,
+                                      decay_updates=opt.epochs * len(dataloader) * 1 / 4).to(gpu)
 
 # Create Logger instance
-logger = Logger(model_name='LRPGAN', data_name=opt.dataset, dir_name=outf, make_fresh=True if not opt.cont else False)
+logger = Logger(model_name='LRPGAN', data_name=opt.dataset, dir_name=outf,
+                make_fresh=not opt.cont and not opt.resume) if rank == 0 else None
 print('Created Logger')
+
+# Checkpoints are written in the background
+checkpoint_writer = CheckpointWriter()
+statepath = '{}/training_state.pth'.format(checkpointdir)
+
+
+def training_state(epoch, n_batch):
+    """
+    Everything needed to continue training after n_batch batches of epoch
+    """
+    return {'generator': generator.state_dict(), 'discriminator': discriminator.state_dict(),
+            'g_optimizer': g_optimizer.state_dict(), 'd_optimizer': d_optimizer.state_dict(),
+            'epoch': epoch, 'batch': n_batch, 'noise_injection': noise_injection.getState(), 'logger_epoch': Logger.epoch,
+            'fixed_noise': fixed_noise, 'sampler_seed': sampler.seed, 'rng': get_rng_state()}
+
+
+start_epoch = 0
+start_batch = 0
+if opt.resume:
+    # only the first process reads the file, so it does not have to be on a filesystem shared by all machines
+    state = torch.load(opt.resume, map_location='cuda:0' if torch.cuda.is_available() else 'cpu') if rank == 0 else None
+    state = distributed.broadcast(state)
+    generator.load_state_dict(state['generator'])
+    discriminator.load_state_dict(state['discriminator'])
+    g_optimizer.load_state_dict(state['g_optimizer'])
+    d_optimizer.load_state_dict(state['d_optimizer'])
+    start_epoch = state['epoch']
+    start_batch = state['batch']
+    if 'noise_injection' in state:
+        noise_injection.setState(state['noise_injection'])
+    else:
+        noise_injection.variance = state['add_noise_var']
+    Logger.epoch = state['logger_epoch']
+    fixed_noise = state['fixed_noise'].to(gpu)
+    sampler.seed = state['sampler_seed']
+    set_rng_state(state['rng'])
+    if rank > 0:
+        # the state is the one of the first process, the others draw their seeds from it, so they keep drawing
+        # different noise than the first process and than before the restart
+        torch.manual_seed(int(torch.randint(2 ** 62, (1,)).item()) + rank)
+        noise_injection.seed = int(torch.randint(2 ** 62, (1,)).item())
+        noise_injection.generator = None
+    print('Resuming at epoch {}, batch {}'.format(start_epoch, start_batch))
+    del state
+last_state_save = time.time()
 # training
 
-for epoch in range(opt.epochs):
-    for n_batch, (batch_data, _) in enumerate(dataloader, 0):
+for epoch in range(start_epoch, opt.epochs):
+    log_epoch = epoch if not opt.cont else epoch + opt.cont
+    sampler.set_epoch(epoch, start_batch * opt.batchSize)
+    for n_batch, (batch_data, _) in enumerate(dataloader, start_batch):
         batch_size = batch_data.size(0)
-        add_noise_var = adjust_variance(add_noise_var, initial_additive_noise_var, opt.epochs * len(dataloader) * 1 / 4)
+        noise_injection.step()
 
 
         ############################
@@ -293,9 +343,9 @@ for epoch in range(opt.epochs):
 
         # Add noise to input
         if opt.add_noise:
-            real_data = added_gaussian_chi(real_data, add_noise_var)
+            real_data = noise_injection(real_data)
 
-        prediction_real = discriminator(real_data)
+        prediction_real = train_discriminator(real_data)
         d_err_real = loss(prediction_real, label_real)
         d_err_real.backward()
         d_real = prediction_real.mean().item()
@@ -308,9 +358,9 @@ for epoch in range(opt.epochs):
 
         # Add noise to fake
         if opt.add_noise:
-            fake = added_gaussian_chi(fake, add_noise_var)
+            fake = noise_injection(fake)
 
-        prediction_fake = discriminator(fake.detach())
+        prediction_fake = train_discriminator(fake.detach())
         d_err_fake = loss(prediction_fake, label_fake)
         d_err_fake.backward()
         d_fake_1 = prediction_fake.mean().item()
@@ -323,7 +373,7 @@ for epoch in range(opt.epochs):
             grad_alpha = torch.rand(batch_size, nc, 1, 1).expand(real_data.size())
             x_gp = torch.tensor(grad_alpha * real_data.data + (1 - grad_alpha) * (real_data.data + 0.5 * real_data.data.std() * torch.rand(real_data.size())),
                                 requires_grad=True)
-            pred_hat = discriminator(x_gp)
+            pred_hat = train_discriminator(x_gp)
             gradients = torch.autograd.grad(outputs=pred_hat, inputs=x_gp, grad_outputs=torch.ones(pred_hat.size()),
                                             create_graph=True, retain_graph=True, only_inputs=True)[0]
             gradient_penalty = lambda_ * ((gradients.norm(2, dim=1) - 1) ** 2).mean()
@@ -339,14 +389,14 @@ for epoch in range(opt.epochs):
         ###########################
         generator.zero_grad()
         noise = torch.randn(batch_size, nz, 1, 1, device=gpu)
-        fake = generator(noise)
+        fake = train_generator(noise)
         fake = F.pad(fake, (p, p, p, p), mode='replicate')
 
         # Add noise to fake
         if opt.add_noise:
-            fake = added_gaussian_chi(fake, add_noise_var)
+            fake = noise_injection(fake)
 
-        prediction_fake_g = discriminator(fake)
+        prediction_fake_g = train_discriminator(fake)
         label_real = real_label(batch_size).to(gpu)
         g_err = loss(prediction_fake_g, label_real)
         g_err.backward()
@@ -356,13 +406,19 @@ for epoch in range(opt.epochs):
         if not opt.freezeG or (opt.freezeG and epoch <= freezeEpochs):
             g_optimizer.step()
 
-        logger.log(d_error_total, g_err, epoch, n_batch, len(dataloader))
+        # losses and predictions averaged over all processes
+        d_error_total, g_error, d_real, d_fake_1, d_fake_2 = distributed.all_reduce_mean(
+            [d_error_total, g_err.item(), d_real, d_fake_1, d_fake_2])
 
-        if n_batch % 10 == 0:
+        if rank == 0:
+            logger.log(d_error_total, g_error, epoch, n_batch, len(dataloader), d_real, d_fake_1, d_fake_2)
+
+        if n_batch % 10 == 0 and rank == 0:
             print('[%d/%d][%d/%d] Loss_D: %.4f Loss_G: %.4f D(x): %.4f D(G(z)): %.4f / %.4f'
                   % (epoch, opt.epochs, n_batch, len(dataloader),
-                     d_error_total, g_err.item(), d_real, d_fake_1, d_fake_2))
+                     d_error_total, g_error, d_real, d_fake_1, d_fake_2))
 
+        # runs in every process, the synchronised batch norm layers need all of them, but only the first one writes
         if n_batch % 100 == 0:
             Logger.batch = n_batch
             # generate fake with fixed noise
@@ -412,22 +468,34 @@ for epoch in range(opt.epochs):
             else:
                 log_epoch = epoch + opt.cont
 
-            img_name = logger.log_images(
-                test_fake_cat.detach(), torch.sum(test_relevance_cat.detach(), dim=1, keepdim=True), test_fake.size(0),
-                log_epoch, n_batch, len(dataloader), printdata, noLabel=opt.nolabel
-            )
+            if rank == 0:
+                img_name = logger.log_images(
+                    test_fake_cat.detach(), torch.sum(test_relevance_cat.detach(), dim=1, keepdim=True), test_fake.size(0),
+                    log_epoch, n_batch, len(dataloader), printdata, noLabel=opt.nolabel
+                )
+
 
+                # show images inline
+                # comment = '{:.4f}-{:.4f}'.format(printdata['test_prob'], printdata['real_test_prob'])
+                # subprocess.call([os.path.expanduser('~/.iterm2/imgcat'),
+                #                  outf + '/' + opt.dataset + '/epoch_' + str(epoch) + '_batch_' + str(n_batch) + '_' + comment + '.png'])
 
-            # show images inline
-            # comment = '{:.4f}-{:.4f}'.format(printdata['test_prob'], printdata['real_test_prob'])
-            # subprocess.call([os.path.expanduser('~/.iterm2/imgcat'),
-            #                  outf + '/' + opt.dataset + '/epoch_' + str(epoch) + '_batch_' + str(n_batch) + '_' + comment + '.png'])
+                status = logger.display_status(epoch, opt.epochs, n_batch, len(dataloader), d_error_total, g_error,
+                                               prediction_real, prediction_fake)
 
-            status = logger.display_status(epoch, opt.epochs, n_batch, len(dataloader), d_error_total, g_err,
-                                           prediction_real, prediction_fake)
+        if rank == 0 and time.time() - last_state_save > opt.state_interval * 60:
+            checkpoint_writer.save(training_state(epoch, n_batch + 1), statepath)
+            last_state_save = time.time()
 
+    start_batch = 0
     Logger.epoch += 1
 
     # do checkpointing
-    torch.save(generator.state_dict(), '%s/generator_epoch_{}.pth'.format(str(log_epoch)) % (checkpointdir))
-    torch.save(discriminator.state_dict(), '%s/discriminator_epoch_{}.pth'.format(str(log_epoch)) % (checkpointdir))
+    if rank == 0:
+        checkpoint_writer.save(generator.state_dict(), '%s/generator_epoch_{}.pth'.format(str(log_epoch)) % (checkpointdir))
+        checkpoint_writer.save(discriminator.state_dict(), '%s/discriminator_epoch_{}.pth'.format(str(log_epoch)) % (checkpointdir))
+        checkpoint_writer.save(training_state(epoch + 1, 0), statepath)
+    last_state_save = time.time()
+
+checkpoint_writer.close()
+distributed.cleanup()
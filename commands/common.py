@@ -0,0 +1,37 @@
+import os
+
+import torch
+
+from utils.evaluation import evaluate_epochs
+
+'''
+    Arguments and output handling shared by the evaluation commands
+'''
+
+
+def add_evaluation_arguments(parser, outf):
+    """
+    :param outf: default output folder of the command
+    """
+    parser.add_argument('--epochs', type=int, required=True, help='evaluate the epochs 0 .. epochs - 1')
+    parser.add_argument('--outf', default=outf, help='folder for the results')
+    parser.add_argument('--filename', required=True, help='results are written to <outf>/<filename>.jsonl and .txt')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of evaluation processes, every process loads its own datasets and networks')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads per evaluation process')
+
+
+def evaluate(metric, opt):
+    """
+    Run metric over the epochs of opt and write its summary next to the results
+    """
+    os.makedirs(opt.outf, exist_ok=True)
+    # a single worker keeps the threads of the cpu profile
+    threads = opt.threads or (torch.get_num_threads() if opt.workers == 1 else None)
+    results = evaluate_epochs(metric, range(opt.epochs), '{}/{}.jsonl'.format(opt.outf, opt.filename),
+                              workers=opt.workers, threads=threads)
+    summary = metric.summary(results)
+    print(summary)
+    with open('{}/{}.txt'.format(opt.outf, opt.filename), 'w') as f:
+        f.write(summary + '\n')
+    return results
@@ -0,0 +1,28 @@
+from commands.common import add_evaluation_arguments, evaluate
+from utils.datasets import DATASETS
+from utils.metrics import Confusion
+
+'''
+    Confusion matrix of the discriminator on real test images and generated images
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('--genfolder_d', required=True, help='checkpoint folder or checkpoint archive')
+    parser.add_argument('--genfolder_g', required=True, help='checkpoint folder or checkpoint archive')
+    parser.add_argument('--dataset', required=True, choices=DATASETS)
+    parser.add_argument('--dataset_root', default='../dataset')
+    parser.add_argument('--batch_size', type=int, default=128, help='generated images per batch')
+    parser.add_argument('--ngf', type=int, default=128)
+    parser.add_argument('--ndf', type=int, default=128)
+    parser.add_argument('--alpha', type=int, default=1)
+    parser.add_argument('--stabilize_batches', default=20, type=int,
+                        help='batches used to recompute the batch norm statistics, 0 for the whole test set')
+    add_evaluation_arguments(parser, 'output/confusion')
+
+
+def run(opt, factory):
+    metric = Confusion(opt.genfolder_g, opt.genfolder_d, opt.dataset, root=opt.dataset_root,
+                       noise_batch_size=opt.batch_size, ngf=opt.ngf, ndf=opt.ndf, alpha=opt.alpha,
+                       stabilize_batches=opt.stabilize_batches or None, cache_dir='{}/bn_statistics'.format(opt.outf))
+    evaluate(metric, opt)
@@ -0,0 +1,35 @@
+import os
+
+import PIL.Image
+import torch
+
+from utils.explain_service import relevance_png
+
+'''
+    Relevance maps of image files, written as <outf>/<image name>_relevance.png
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('images', nargs='+', help='image files')
+    parser.add_argument('--loadD', required=True, help='path to discriminator')
+    parser.add_argument('--nc', type=int, default=3)
+    parser.add_argument('--ndf', type=int, default=128)
+    parser.add_argument('--alpha', type=int, default=1)
+    parser.add_argument('--imageSize', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--outf', default='output/explain')
+
+
+def run(opt, factory):
+    explainer = factory.explainer(opt.loadD, nc=opt.nc, ndf=opt.ndf, alpha=opt.alpha, image_size=opt.imageSize)
+    os.makedirs(opt.outf, exist_ok=True)
+    for start in range(0, len(opt.images), opt.batch_size):
+        paths = opt.images[start:start + opt.batch_size]
+        images = torch.stack([explainer.preprocess(PIL.Image.open(path)) for path in paths])
+        relevance, probabilities = explainer.explain(images)
+        for path, relevance_map, probability in zip(paths, relevance, probabilities.view(-1).tolist()):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(os.path.join(opt.outf, '{}_relevance.png'.format(name)), 'wb') as f:
+                f.write(relevance_png(relevance_map))
+            print('{}: {:.4f}'.format(path, probability))
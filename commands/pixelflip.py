@@ -0,0 +1,135 @@
+import os
+
+import torch
+import torch.nn.functional as F
+import torch.utils.data
+import torch.utils.data.dataset
+
+import models._DRAGAN as dcgm
+from utils.checkpoint import state_dict_fingerprint
+from utils.datasets import CHANNELS, DATASETS
+from utils.explain import relevance
+from utils.metrics import inference_mode, load_state_dict, stabilize_batch_norm
+from utils.relevance_cache import RelevanceCache, rule_config
+
+'''
+    Pixel flipping, the same evaluation as tests/PixelFlip.py:
+    the k most (or least) relevant pixels of every image are negated and the discriminator scores before and
+    after flipping are compared. Relevance is computed once per image for all percentages and every
+    percentage appends "k before after" to <outf>/<filename>_highest_<highest>.txt
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('--loadD', required=True, help='path to discriminator')
+    parser.add_argument('--dataset', required=True, choices=DATASETS)
+    parser.add_argument('--dataset_root', default='../dataset')
+    parser.add_argument('--ndf', type=int, default=128)
+    parser.add_argument('--alpha', type=int, default=2)
+    parser.add_argument('--num_images', type=int, default=1000)
+    parser.add_argument('--p', type=int, required=True, help='flip 0 .. p - 1 percent of the pixels')
+    parser.add_argument('--highest', action='store_true', help='flip the most instead of the least relevant pixels')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--stabilize_batches', type=int, default=30,
+                        help='training batches used to recompute the batch norm statistics')
+    parser.add_argument('--filename', required=True)
+    parser.add_argument('--outf', default='output/pixelflip')
+    parser.add_argument('--relevance_cache', default=None, help='folder to cache relevance maps in between runs')
+    parser.add_argument('--cache_size', default=1024, type=int, help='size of the relevance cache in MB')
+
+
+def canonical_discriminator(factory, opt, padding=1):
+    """
+    Discriminator with batch norm statistics of the training set folded into the convolutions
+    """
+    device = factory.device()
+    discriminator = dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc=CHANNELS[opt.dataset], alpha=opt.alpha,
+                                                                     ndf=opt.ndf, ngpu=1)
+    load_state_dict(discriminator, factory.state_dict(opt.loadD), strict=False)
+    discriminator.to(device)
+
+    loader = torch.utils.data.DataLoader(factory.dataset(opt.dataset, 64, opt.dataset_root, train=True),
+                                         batch_size=opt.batch_size, shuffle=False, num_workers=0)
+    batches = (F.pad(batch_data, (padding,) * 4, mode='replicate').to(device)
+               for _, (batch_data, _) in zip(range(opt.stabilize_batches), loader))
+    stabilize_batch_norm(discriminator, batches)
+
+    discriminator.passBatchNormParametersToConvolution()
+    discriminator.removeBatchNormLayers()
+    discriminator.to(memory_format=factory.memory_format)
+    discriminator.eval()
+    for module in discriminator.modules():
+        if module.__class__.__name__.find('Eps') != -1:
+            module.epsilon = 1e-9
+    return discriminator
+
+
+def flip_pixels(images, relevance_map, k, highest):
+    """
+    Negate the k most or least relevant pixels of every image in all color channels
+    :param relevance_map: N x H x W relevance summed over the color channels
+    """
+    if k == 0:
+        return images
+    flat = relevance_map.reshape(len(relevance_map), -1)
+    indices = torch.topk(flat, k=k, largest=highest)[1]
+    sign = torch.ones_like(flat).scatter_(1, indices, -1)
+    return images * sign.view(len(images), 1, *relevance_map.shape[1:])
+
+
+def run(opt, factory):
+    p = 1
+    device = factory.device()
+    key = ('pixelflip', opt.loadD, opt.dataset, opt.dataset_root, opt.ndf, opt.alpha, opt.batch_size,
+           opt.stabilize_batches)
+    discriminator = factory.get(key, lambda: canonical_discriminator(factory, opt, p))
+    fingerprint = state_dict_fingerprint(discriminator.state_dict())
+    cache = RelevanceCache(opt.relevance_cache, max_bytes=opt.cache_size << 20) if opt.relevance_cache else None
+
+    def get_relevance(images, flip):
+        if cache is None:
+            return relevance(discriminator, images, flip)
+        return cache.relevance(images, fingerprint, rule_config(discriminator, flip),
+                               lambda missing: relevance(discriminator, missing, flip))
+
+    dataset = factory.dataset(opt.dataset, 64, opt.dataset_root, train=True)
+    subset = torch.utils.data.dataset.Subset(dataset, range(min(opt.num_images, len(dataset))))
+    loader = torch.utils.data.DataLoader(subset, batch_size=opt.batch_size, shuffle=False, num_workers=0)
+
+    # number of flipped pixels per percentage of the 64 x 64 images
+    ks = [int(64 * 64 * percent / 100) for percent in range(opt.p)]
+    before_scores = []
+    after_scores = [[] for _ in ks]
+    for batch_data, _ in loader:
+        batch_data = batch_data.to(device)
+        padded = F.pad(batch_data, (p, p, p, p), mode='replicate')
+        with inference_mode():
+            probs = discriminator.score(padded).view(-1)
+        before_scores.append(probs.cpu())
+
+        # relevance of confidently real images is propagated without flipping the last layer
+        real = probs > 0.5
+        relevance_map = torch.empty_like(padded)
+        for flip, mask in ((False, real), (True, ~real)):
+            if mask.any():
+                relevance_map[mask] = get_relevance(padded[mask], flip)
+        relevance_map = torch.sum(relevance_map, 1)[:, p:-p, p:-p]
+
+        with inference_mode():
+            for scores, k in zip(after_scores, ks):
+                flipped = F.pad(flip_pixels(batch_data, relevance_map, k, opt.highest), (p, p, p, p),
+                                mode='replicate')
+                scores.append(discriminator.score(flipped).view(-1).cpu())
+
+    os.makedirs(opt.outf, exist_ok=True)
+    before = torch.cat(before_scores).mean().item()
+    with open('{}/{}_highest_{}.txt'.format(opt.outf, opt.filename, opt.highest), 'a+') as f:
+        for percent, (scores, k) in enumerate(zip(after_scores, ks)):
+            after = torch.cat(scores).mean().item()
+            print('{}% ({} pixels): before {:.4f}, after {:.4f}, change of {:.2f}%'.format(
+                percent, k, before, after, 100 - before / after * 100))
+            f.write('{} {} {}\n'.format(k, before, after))
+
+    if cache is not None:
+        cache.close()
+        print('Relevance cache: {} hits, {} misses'.format(cache.hits, cache.misses))
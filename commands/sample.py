@@ -0,0 +1,13 @@
+from utils.metrics import load_state_dict
+from utils.sampling import GENERATORS, add_arguments, write_samples
+
+'''
+    Generated samples as png files or a uint8 memory map, see utils.sampling
+'''
+
+
+def run(opt, factory):
+    generator = factory.network(GENERATORS[opt.generator], opt.nc, opt.ngf, 1)
+    load_state_dict(generator, factory.state_dict(opt.loadG), strict=False)
+    generator.eval()
+    write_samples(generator, opt)
@@ -0,0 +1,33 @@
+from commands.common import add_evaluation_arguments, evaluate
+from utils.metrics import FrechetDistance, InceptionScore
+
+'''
+    Inception score and Frechet distance of MNIST generator checkpoints
+'''
+
+METRICS = {'inception': InceptionScore, 'fid': FrechetDistance}
+
+
+def add_arguments(parser):
+    parser.add_argument('--metric', nargs='+', default=['inception'], choices=sorted(METRICS))
+    parser.add_argument('--genfolder', required=True, help='checkpoint folder or checkpoint archive')
+    parser.add_argument('--num_images', type=int, default=None, help='generated images, default of the metric')
+    parser.add_argument('--batch_size', type=int, default=None, help='default of the metric')
+    parser.add_argument('--ngf', type=int, default=128)
+    parser.add_argument('--splits', type=int, default=10, help='number of splits for the inception score')
+    parser.add_argument('--dataset_root', default='../dataset', help='MNIST location, real statistics are cached there')
+    add_evaluation_arguments(parser, 'output/score')
+
+
+def run(opt, factory):
+    filename = opt.filename
+    for name in opt.metric:
+        kwargs = {key: value for key, value in (('num_images', opt.num_images), ('batch_size', opt.batch_size))
+                  if value is not None}
+        if name == 'inception':
+            metric = InceptionScore(opt.genfolder, splits=opt.splits, ngf=opt.ngf, **kwargs)
+        else:
+            metric = FrechetDistance(opt.genfolder, root=opt.dataset_root, ngf=opt.ngf, **kwargs)
+        opt.filename = '{}_{}'.format(filename, name) if len(opt.metric) > 1 else filename
+        evaluate(metric, opt)
+    opt.filename = filename
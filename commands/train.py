@@ -0,0 +1,28 @@
+import argparse
+import os
+import runpy
+import sys
+
+'''
+    Training runs the DRAGAN scripts unchanged, all arguments after the variant are passed on to the script
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {'canonical': 'DRAGANcanonical.py', 'leaky': 'DRAGANLeaky.py'}
+
+
+def add_arguments(parser):
+    parser.add_argument('variant', choices=sorted(SCRIPTS), help='DRAGANcanonical.py or DRAGANLeaky.py')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of the training script')
+
+
+def run(opt, factory):
+    script = os.path.join(ROOT, SCRIPTS[opt.variant])
+    argv = sys.argv
+    # the scripts name their output folder after sys.argv[0]
+    sys.argv = [script] + opt.arguments
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        sys.argv = argv
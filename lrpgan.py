@@ -0,0 +1,91 @@
+from __future__ import print_function
+import argparse
+import importlib
+import sys
+
+'''
+    Single entry point for training, explanation and evaluation
+        python lrpgan.py <command> [arguments] [:: <command> [arguments] ...]
+    Commands separated by :: run one after another in the same process and share the datasets, networks
+    and checkpoints loaded through utils.factory, e.g.
+        python lrpgan.py score --metric inception fid ... :: confusion ... :: pixelflip ...
+    Only the modules of the selected commands are imported. A command is a module with
+        add_arguments(parser)       adds its arguments to an argparse parser
+        run(opt, factory)           runs it with the parsed arguments and the shared utils.factory.Factory
+'''
+
+SEPARATOR = '::'
+
+# command name: (module, description)
+COMMANDS = {
+    'train': ('commands.train', 'train a DRAGAN with DRAGANcanonical.py or DRAGANLeaky.py'),
+    'explain': ('commands.explain', 'relevance maps of image files'),
+    'pixelflip': ('commands.pixelflip', 'discriminator scores after flipping the most or least relevant pixels'),
+    'confusion': ('commands.confusion', 'confusion matrix of the discriminator for every epoch'),
+    'score': ('commands.score', 'inception score and Frechet distance of the generator for every epoch'),
+    'sample': ('commands.sample', 'write generated samples to png files or a uint8 memory map'),
+}
+
+
+def register(name, module, description=''):
+    """
+    Add a command, module is imported only when the command is used
+    """
+    COMMANDS[name] = (module, description)
+
+
+def usage():
+    lines = ['usage: lrpgan.py <command> [arguments] [{} <command> [arguments] ...]'.format(SEPARATOR), '',
+             'commands:']
+    lines += ['  {:<12}{}'.format(name, description) for name, (_, description) in sorted(COMMANDS.items())]
+    lines += ['', 'lrpgan.py <command> -h shows the arguments of a command']
+    return '\n'.join(lines)
+
+
+def split_chain(argv):
+    chain = [[]]
+    for argument in argv:
+        if argument == SEPARATOR:
+            chain.append([])
+        else:
+            chain[-1].append(argument)
+    return chain
+
+
+def parse(argv):
+    """
+    :return: (command module, parsed arguments)
+    """
+    if not argv or argv[0] not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        sys.exit('unknown command {}'.format(argv[0]) if argv else 'missing command')
+    module_name, description = COMMANDS[argv[0]]
+    module = importlib.import_module(module_name)
+    parser = argparse.ArgumentParser(prog='lrpgan.py {}'.format(argv[0]), description=description)
+    module.add_arguments(parser)
+    return module, parser.parse_args(argv[1:])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return
+
+    # all commands are parsed first, so a typo in the last one does not surface after hours of evaluation
+    commands = [parse(arguments) for arguments in split_chain(argv)]
+
+    import torch
+    import utils.tuning as tuning
+    from utils.factory import factory
+    # training applies the cpu profile of the training step itself
+    if not torch.cuda.is_available() and any(module.__name__ != COMMANDS['train'][0] for module, _ in commands):
+        factory.memory_format = tuning.memory_format(tuning.apply_profile('explain'))
+    for module, opt in commands:
+        module.run(opt, factory)
+    if len(commands) > 1:
+        print('Factory cache: {} hits, {} misses'.format(factory.hits, factory.misses))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import copy
 from collections import OrderedDict
 
 import torch
@@ -31,10 +32,69 @@ class EDiscriminator(nn.Module):
         return x
 
 
+def fold_batch_norm(layer, bn):
+    """
+    Copy of a Conv2d or ConvTranspose2d with the running statistics and affine parameters of the following
+    BatchNorm2d folded into its weight and bias
+    """
+    gamma = bn.weight if bn.affine else torch.ones_like(bn.running_var)
+    beta = bn.bias if bn.affine else torch.zeros_like(bn.running_mean)
+    scale = gamma / torch.sqrt(bn.running_var + bn.eps)
+    bias = layer.bias if layer.bias is not None else torch.zeros_like(bn.running_mean)
+
+    if isinstance(layer, nn.ConvTranspose2d):
+        # transposed weights are in_channels x out_channels / groups x kH x kW
+        groups = layer.groups
+        weight = layer.weight.reshape(groups, layer.in_channels // groups, layer.out_channels // groups,
+                                      *layer.kernel_size)
+        weight = (weight * scale.reshape(groups, 1, -1, 1, 1)).reshape_as(layer.weight)
+    else:
+        weight = layer.weight * scale.reshape(-1, 1, 1, 1)
+
+    folded = copy.deepcopy(layer)
+    folded.weight = nn.Parameter(weight.detach().clone())
+    folded.bias = nn.Parameter(((bias - bn.running_mean) * scale + beta).detach().clone())
+    return folded
+
+
+class InferenceGenerator(nn.Module):
+    """
+    Frozen generator for sampling, every BatchNorm2d is folded into the convolution in front of it
+    """
+
+    def __init__(self, generator):
+        super(InferenceGenerator, self).__init__()
+        layers = []
+        for module in generator.net if hasattr(generator, 'net') else generator.main:
+            if isinstance(module, nn.BatchNorm2d) and layers and isinstance(layers[-1],
+                                                                            (nn.Conv2d, nn.ConvTranspose2d)):
+                layers[-1] = fold_batch_norm(layers[-1], module)
+            else:
+                layers.append(copy.deepcopy(module))
+        self.net = nn.Sequential(*layers)
+        self.eval()
+        for parameter in self.parameters():
+            parameter.requires_grad_(False)
+
+    def forward(self, x):
+        with torch.no_grad():
+            return self.net(x)
+
+
+class InferenceGeneratorMixin:
+
+    def inferenceGenerator(self):
+        """
+        Generator with folded batch norm layers for bulk sampling. Uses the running statistics, i.e. the samples
+        equal those of the generator in eval mode.
+        """
+        return InferenceGenerator(self)
+
+
 # ########################################        Standard LRP DCGAN      ########################################
 
 
-class LRPGeneratorNet(nn.Module):
+class LRPGeneratorNet(InferenceGeneratorMixin, nn.Module):
     def __init__(self, nc, ngf, ngpu=1):
         super(LRPGeneratorNet, self).__init__()
         self.ngpu = ngpu
@@ -190,7 +250,7 @@ class LRPDiscriminatorNet(nn.Module):
 
 # ########################################        Standard DCGAN      ########################################
 
-class Generator(nn.Module):
+class Generator(InferenceGeneratorMixin, nn.Module):
     def __init__(self, nc, ngf, ngpu):
         super(Generator, self).__init__()
         self.ngpu = ngpu
@@ -262,7 +322,7 @@ class Discriminator(nn.Module):
 
 # ######################################## Less Checkerboard pattern ########################################
 
-class GeneratorNetLessCheckerboard(nn.Module):
+class GeneratorNetLessCheckerboard(InferenceGeneratorMixin, nn.Module):
     def __init__(self, nc, ngf, ngpu):
         super(GeneratorNetLessCheckerboard, self).__init__()
         self.ngpu = ngpu
@@ -327,7 +387,7 @@ class Squeeze(nn.Module):
         return input.view(-1, 100)
 
 
-class GeneratorNetLessCheckerboardUpsample(nn.Module):
+class GeneratorNetLessCheckerboardUpsample(InferenceGeneratorMixin, nn.Module):
     def __init__(self, nc, ngf, ngpu):
         super(GeneratorNetLessCheckerboardUpsample, self).__init__()
         self.ngpu = ngpu
@@ -377,7 +437,69 @@ class GeneratorNetLessCheckerboardUpsample(nn.Module):
         return output
 
 
-class DiscriminatorNetLessCheckerboardToCanonical(nn.Module):
+class CanonicalScoreMixin:
+    """
+    Probability-only forward pass for the canonical discriminators.
+    Batch norm layers are folded into the preceding convolutions with their running statistics, nothing is
+    stored for relevance propagation and the last convolution is only evaluated once.
+    The folded weights are cached until a parameter or buffer of the network changes.
+    """
+
+    def score(self, x, grad=False):
+        """
+        :param x: batch of images
+        :param grad: keep the graph so the probability can be differentiated w.r.t. x
+        :return: probability of each image being real, same as the second output of forward in eval mode
+        """
+        # folded outside of inference mode, otherwise the cached weights are inference tensors a later
+        # score(x, grad=True) cannot differentiate through
+        steps = self._scorePlan()
+        with torch.enable_grad() if grad else getattr(torch, 'inference_mode', torch.no_grad)():
+            for step in steps:
+                if isinstance(step, nn.Module):
+                    x = step(x)
+                else:
+                    weight, bias, stride, padding, slope = step
+                    x = F.conv2d(x, weight, bias, stride, padding)
+                    if slope == 0:
+                        x = F.relu(x, inplace=True)
+                    elif slope is not None:
+                        x = F.leaky_relu(x, slope, inplace=True)
+            return torch.sigmoid(x).view(-1)
+
+    def _scorePlan(self):
+        key = tuple((t.data_ptr(), t._version) for t in list(self.parameters()) + list(self.buffers()))
+        if getattr(self, '_scoreKey', None) != key:
+            # normal tensors even if the caller runs in inference mode
+            with getattr(torch, 'inference_mode', lambda mode: torch.no_grad())(False), torch.no_grad():
+                self._scoreSteps = self._foldLayers()
+            self._scoreKey = key
+        return self._scoreSteps
+
+    def _foldLayers(self):
+        steps = []
+        for module in list(self.net.modules()) + [self.lastConvolution]:
+            if isinstance(module, nn.Conv2d):
+                bias = module.bias if module.bias is not None else torch.zeros_like(module.weight[:, 0, 0, 0])
+                steps.append([module.weight.detach().clone(), bias.detach().clone(), module.stride, module.padding,
+                              None])
+            elif isinstance(module, nn.BatchNorm2d):
+                weight, bias = steps[-1][0], steps[-1][1]
+                scale = module.weight / torch.sqrt(module.running_var + module.eps)
+                steps[-1][0] = weight * scale.reshape(-1, 1, 1, 1)
+                steps[-1][1] = (bias - module.running_mean) * scale + module.bias
+            elif isinstance(module, nn.LeakyReLU):
+                steps[-1][4] = module.negative_slope
+            elif isinstance(module, nn.ReLU):
+                steps[-1][4] = 0
+            elif isinstance(module, (nn.Dropout, nn.Sequential)):
+                continue
+            else:
+                steps.append(module)
+        return [tuple(step) if isinstance(step, list) else step for step in steps]
+
+
+class DiscriminatorNetLessCheckerboardToCanonical(CanonicalScoreMixin, nn.Module):
 
     def __init__(self, nc, ndf, alpha, ngpu=1):
         super(DiscriminatorNetLessCheckerboardToCanonical, self).__init__()
@@ -503,7 +625,7 @@ class DiscriminatorNetLessCheckerboardToCanonical(nn.Module):
         )
 
 
-class DiscriminatorNetLessCheckerboardToCanonicalAB(nn.Module):
+class DiscriminatorNetLessCheckerboardToCanonicalAB(CanonicalScoreMixin, nn.Module):
 
     def __init__(self, nc, ndf, alpha, ngpu=1):
         super(DiscriminatorNetLessCheckerboardToCanonicalAB, self).__init__()
@@ -629,7 +751,7 @@ class DiscriminatorNetLessCheckerboardToCanonicalAB(nn.Module):
         )
 
 
-class DiscriminatorNetLessCheckerboardToCanonicalLeaky(nn.Module):
+class DiscriminatorNetLessCheckerboardToCanonicalLeaky(CanonicalScoreMixin, nn.Module):
 
     def __init__(self, nc, ndf, alpha, ngpu=1):
         super(DiscriminatorNetLessCheckerboardToCanonicalLeaky, self).__init__()
@@ -759,7 +881,7 @@ class DiscriminatorNetLessCheckerboardToCanonicalLeaky(nn.Module):
 # ######################################## Smoothing layer ########################################
 
 
-class SmoothingLayerDiscriminator(nn.Module):
+class SmoothingLayerDiscriminator(CanonicalScoreMixin, nn.Module):
 
     def __init__(self, nc, ndf, alpha, ngpu=1):
         super(SmoothingLayerDiscriminator, self).__init__()
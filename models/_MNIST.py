@@ -0,0 +1,32 @@
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class Net(nn.Module):
+    """
+    MNIST classifier used for evaluating generated digits, weights in tests/mnist_cnn.pt
+    """
+
+    def __init__(self):
+        super(Net, self).__init__()
+        self.conv1 = nn.Conv2d(1, 20, 5, 1)
+        self.conv2 = nn.Conv2d(20, 50, 5, 1)
+        self.conv3 = nn.Conv2d(50, 80, 5, 1)
+        self.fc1 = nn.Linear(4 * 4 * 80, 500)
+        self.fc2 = nn.Linear(500, 10)
+
+    def features(self, x):
+        """
+        Penultimate (fc1) activations, used for the Frechet distance
+        """
+        x = F.relu(self.conv1(x))
+        x = F.max_pool2d(x, 2, 2)
+        x = F.relu(self.conv2(x))
+        x = F.max_pool2d(x, 2, 2)
+        x = F.relu(self.conv3(x))
+        x = F.max_pool2d(x, 2, 2)
+        x = x.view(-1, 4 * 4 * 80)
+        return F.relu(self.fc1(x))
+
+    def forward(self, x):
+        return self.fc2(self.features(x))
@@ -1,4 +1,5 @@
 import torch
+import torch.distributed as dist
 from torch import nn
 from utils import utils
 import copy
@@ -593,6 +594,72 @@ class BatchNorm2d(nn.BatchNorm2d):
                 'mean': copy.deepcopy(self.running_mean)}
 
 
+class _AllReduce(torch.autograd.Function):
+    """
+    Differentiable sum over all processes, the gradient is summed over all processes as well
+    """
+
+    @staticmethod
+    def forward(ctx, x):
+        x = x.clone()
+        dist.all_reduce(x)
+        return x
+
+    @staticmethod
+    def backward(ctx, grad):
+        return _AllReduce.apply(grad)
+
+
+class SyncBatchNorm2d(BatchNorm2d):
+    """
+    BatchNorm2d that normalizes with the statistics of the batches of all processes of the torch.distributed
+    process group, so the running statistics are the same in every process.
+    Unlike nn.SyncBatchNorm it works on the cpu with the gloo backend. Outside of a process group it is a
+    plain BatchNorm2d.
+    """
+
+    def forward(self, x):
+        if not self.training or not dist.is_available() or not dist.is_initialized() or dist.get_world_size() == 1:
+            return super().forward(x)
+
+        # sums, square sums and element count of all processes in a single differentiable all-reduce
+        count = x.numel() // x.size(1)
+        sums = torch.cat((x.sum(dim=[0, 2, 3]), (x * x).sum(dim=[0, 2, 3]), x.new_full((1,), count)))
+        sums = _AllReduce.apply(sums)
+        n = sums[-1]
+        mean, mean_sq = sums[:self.num_features] / n, sums[self.num_features:-1] / n
+
+        if self.track_running_stats:
+            with torch.no_grad():
+                self.num_batches_tracked += 1
+                factor = self.momentum if self.momentum is not None else 1 / float(self.num_batches_tracked)
+                var = (mean_sq - mean * mean) * n / (n - 1)
+                self.running_mean.mul_(1 - factor).add_(mean, alpha=factor)
+                self.running_var.mul_(1 - factor).add_(var, alpha=factor)
+
+        shape = (1, -1, 1, 1)
+        weight = self.weight.view(shape) if self.affine else x.new_ones(shape)
+        bias = self.bias.view(shape) if self.affine else x.new_zeros(shape)
+        return vbn_normalize(x, mean.view(shape), mean_sq.view(shape), weight, bias, self.eps)
+
+
+def sync_batch_norm(module):
+    """
+    Replace all BatchNorm2d layers of module in place by SyncBatchNorm2d layers with the same state
+    :return: module
+    """
+    for name, child in module.named_children():
+        if isinstance(child, nn.BatchNorm2d) and not isinstance(child, SyncBatchNorm2d):
+            layer = SyncBatchNorm2d(child.num_features, child.eps, child.momentum, child.affine,
+                                    child.track_running_stats)
+            layer.load_state_dict(child.state_dict())
+            layer.train(child.training)
+            setattr(module, name, layer.to(next(child.buffers(), torch.empty(0)).device))
+        else:
+            sync_batch_norm(child)
+    return module
+
+
 class GaussianNoise(nn.Module):
     def __init__(self, stddev=0.05):
         super().__init__()
@@ -600,7 +667,105 @@ class GaussianNoise(nn.Module):
 
     def forward(self, x):
         if not self.training: return x
-        return x + torch.Tensor(torch.randn(x.size()) * self.stddev)
+        return x + torch.randn_like(x) * self.stddev
+
+
+class NoiseInjection(nn.Module):
+    """
+    Additive gaussian noise on the discriminator input with a linearly annealed scale.
+    The noise is drawn in place into preallocated buffers on the device of the input, from a generator owned by
+    the module. With chi=True every sample gets its noise scaled by a chi-square(1) draw, i.e. a squared
+    standard normal.
+    """
+
+    def __init__(self, variance=0.1, chi=True, decay_updates=None, seed=None):
+        """
+        :param variance: initial noise scale
+        :param decay_updates: number of step() calls until the scale reaches 0, None keeps it constant
+        :param seed: seed of the noise generator, default drawn from the global torch generator
+        """
+        super().__init__()
+        self.initial_variance = variance
+        self.variance = variance
+        self.chi = chi
+        self.decay_updates = decay_updates
+        self.seed = int(torch.randint(2 ** 62, (1,)).item()) if seed is None else seed
+        self.generator = None
+        self.register_buffer('noise', torch.empty(0), persistent=False)
+        self.register_buffer('scale', torch.empty(0), persistent=False)
+
+    def step(self):
+        """
+        Anneal the scale by initial_variance / decay_updates, call once per update
+        """
+        if self.decay_updates:
+            self.variance = max(self.variance - self.initial_variance / self.decay_updates, 0)
+        return self.variance
+
+    def forward(self, x):
+        if not self.training or self.variance <= 0:
+            return x
+
+        if self.generator is None or self.generator.device != x.device:
+            self.generator = torch.Generator(device=x.device)
+            self.generator.manual_seed(self.seed)
+        if self.noise.shape != x.shape or self.noise.device != x.device or self.noise.dtype != x.dtype:
+            self.noise = torch.empty_like(x, memory_format=torch.contiguous_format)
+            self.scale = x.new_empty((x.size(0),) + (1,) * (x.dim() - 1))
+
+        self.noise.normal_(generator=self.generator)
+        if not self.chi:
+            return x.add(self.noise, alpha=self.variance)
+        self.scale.normal_(generator=self.generator)
+        self.scale.mul_(self.scale).mul_(self.variance)
+        return torch.addcmul(x, self.noise, self.scale)
+
+    def getState(self):
+        """
+        Scale and generator state for resuming training
+        """
+        return {'variance': self.variance, 'seed': self.seed,
+                'generator': self.generator.get_state() if self.generator is not None else None}
+
+    def setState(self, state):
+        self.variance = state['variance']
+        self.seed = state['seed']
+        if state['generator'] is not None:
+            self.generator = torch.Generator(device=self.noise.device)
+            self.generator.set_state(state['generator'])
+
+
+def vbn_statistics(x):
+    """
+    Mean and mean square over (N, H, W).
+    On the gpu var_mean is a single reduction that never materializes x ** 2, on the cpu its kernel is
+    several times slower than two vectorized means, so it is only used for cuda tensors.
+    """
+    if x.is_cuda:
+        var, mean = torch.var_mean(x, dim=[0, 2, 3], unbiased=False, keepdim=True)
+        return mean, var + mean * mean
+    return x.mean(dim=[0, 2, 3], keepdim=True), (x * x).mean(dim=[0, 2, 3], keepdim=True)
+
+
+def vbn_normalize(x, mean, mean_sq, gamma, beta, eps: float):
+    """
+    (x - mean) / std * gamma + beta as one multiply-add with per channel scale and shift
+    """
+    scale = gamma * torch.rsqrt(mean_sq - mean * mean + eps)
+    return torch.addcmul(beta - mean * scale, x, scale)
+
+
+_scriptedVBN = {}
+
+
+def scripted_vbn():
+    """
+    TorchScript versions of vbn_statistics and vbn_normalize, compiled on first use
+    """
+    if not _scriptedVBN:
+        _scriptedVBN['statistics'] = torch.jit.script(vbn_statistics)
+        _scriptedVBN['normalize'] = torch.jit.script(vbn_normalize)
+    return _scriptedVBN['statistics'], _scriptedVBN['normalize']
 
 
 class VBN2d(nn.Module):
@@ -610,11 +775,13 @@ class VBN2d(nn.Module):
     https://discuss.pytorch.org/t/parameter-grad-of-conv-weight-is-none-after-virtual-batch-normalization/9036
     """
 
-    def __init__(self, num_features: int, eps: float = 1e-5):
+    def __init__(self, num_features: int, eps: float = 1e-5, script: bool = False):
         super().__init__()
         # batch statistics
         self.num_features = num_features
         self.eps = eps  # epsilon
+        # use the TorchScript compiled statistics and normalization
+        self.script = script
         # self.ref_mean = self.register_parameter('ref_mean', None)
         # self.ref_mean_sq = self.register_parameter('ref_mean_sq', None)
 
@@ -633,9 +800,8 @@ class VBN2d(nn.Module):
             mean: mean tensor over features
             mean_sq: squared mean tensor over features
         """
-        mean = x.mean(3, keepdim=True).mean(2, keepdim=True).mean(0, keepdim=True)
-        mean_sq = (x ** 2).mean(3, keepdim=True).mean(2, keepdim=True).mean(0, keepdim=True)
-        return mean, mean_sq
+        statistics = scripted_vbn()[0] if self.script else vbn_statistics
+        return statistics(x)
 
     def forward(self, x, ref_mean: None, ref_mean_sq: None):
         """
@@ -688,18 +854,58 @@ class VBN2d(nn.Module):
                 'Squared mean tensor size not equal to number of features : given {}, expected {}'
                     .format(mean_sq.size(1), self.num_features))
 
-        std = torch.sqrt(self.eps + mean_sq - mean ** 2)
-        x = x - mean
-        x = x / std
-        x = x * self.gamma
-        x = x + self.beta
-        return x
+        normalize = scripted_vbn()[1] if self.script else vbn_normalize
+        return normalize(x, mean, mean_sq, self.gamma, self.beta, self.eps)
 
     def __repr__(self):
-        return ('{name}(num_features={num_features}, eps={eps}'
+        return ('{name}(num_features={num_features}, eps={eps}, script={script})'
                 .format(name=self.__class__.__name__, **self.__dict__))
 
 
+class VBNSequential(nn.Sequential):
+    """
+    Sequential container for networks with VBN2d layers.
+    The reference batch statistics do not receive gradients, so they are computed once and cached until a
+    parameter, a buffer or the reference batch changes, i.e. once per optimizer step while training.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.referenceKey = None
+        self.referenceStatistics = None
+
+    def forward(self, x, ref_batch):
+        statistics = iter(self.computeReferenceStatistics(ref_batch))
+        for layer in self:
+            if isinstance(layer, VBN2d):
+                ref_mean, ref_mean_sq = next(statistics)
+                x, _, _ = layer(x, ref_mean, ref_mean_sq)
+            else:
+                x = layer(x)
+        return x
+
+    def computeReferenceStatistics(self, ref_batch):
+        """
+        :return: list of (mean, mean_sq) of the reference batch, one entry per VBN2d layer
+        """
+        key = tuple((t.data_ptr(), t._version) for t in [ref_batch] + list(self.parameters()) + list(self.buffers()))
+        if self.referenceKey != key:
+            statistics = []
+            last = max(i for i, layer in enumerate(self) if isinstance(layer, VBN2d))
+            with torch.no_grad():
+                x = ref_batch
+                # layers behind the last VBN2d do not influence the statistics
+                for layer in self[:last + 1]:
+                    if isinstance(layer, VBN2d):
+                        x, ref_mean, ref_mean_sq = layer(x, None, None)
+                        statistics.append((ref_mean, ref_mean_sq))
+                    else:
+                        x = layer(x)
+            self.referenceStatistics = statistics
+            self.referenceKey = key
+        return self.referenceStatistics
+
+
 class Dropout(nn.Dropout):
 
     def __init__(self, p=0.5, inplace=False):
@@ -830,6 +1036,7 @@ class RelevanceNetAlternate(nn.Sequential):
     def __init__(self, *args):
         super().__init__(*args)
         self.relevanceOutput = None
+        self.relpropObservers = []
 
     def forward(self, input):
 
@@ -845,11 +1052,38 @@ class RelevanceNetAlternate(nn.Sequential):
 
     def relprop(self, relevance):
         R = relevance.clone()
-        # For all layers
-        for layer in self[::-1]:
-            R = layer.relprop(R)
+        # networks pickled before observers existed have no relpropObservers
+        if not getattr(self, 'relpropObservers', None):
+            # For all layers
+            for layer in self[::-1]:
+                R = layer.relprop(R)
+            return R
+
+        for observer in self.relpropObservers:
+            observer.begin(R)
+        for index in range(len(self) - 1, -1, -1):
+            name = 'conv{}'.format(index + 1)
+            for observer in self.relpropObservers:
+                observer.before(name, R)
+            R = self[index].relprop(R)
+            for observer in self.relpropObservers:
+                observer.after(name, R)
+        for observer in self.relpropObservers:
+            observer.end(R)
         return R
 
+    def addRelpropObserver(self, observer):
+        """
+        :param observer: modules.RelevanceInstrumentation.RelpropObserver
+        """
+        if not hasattr(self, 'relpropObservers'):
+            self.relpropObservers = []
+        self.relpropObservers.append(observer)
+        return observer
+
+    def removeRelpropObserver(self, observer):
+        self.relpropObservers.remove(observer)
+
 
 class RelevanceNet(nn.Sequential):
 
@@ -0,0 +1,194 @@
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+import torch
+
+'''
+    Observers for RelevanceNetAlternate.relprop.
+    Observers are attached to the RelevanceNetAlternate of a network (discriminator.net.addRelpropObserver) and
+    are called around the relprop of every layer, layer i of the net is reported as conv<i + 1>.
+    removeBatchNormLayers builds a new net, attach observers after it.
+'''
+
+
+class RelpropObserver:
+
+    def begin(self, relevance):
+        """
+        Called with the relevance entering the net, before the last layer
+        """
+        pass
+
+    def before(self, name, relevance):
+        pass
+
+    def after(self, name, relevance):
+        """
+        Called with the relevance at the input of layer name
+        """
+        pass
+
+    def end(self, relevance):
+        pass
+
+
+class RelevanceCapture(RelpropObserver):
+    """
+    Keeps the relevance of every layer for the last capacity relprop calls in preallocated ring buffers.
+    The buffers are allocated on the first call and again whenever the relevance shape changes,
+    recording a layer is a single copy (or channel sum) into the buffer.
+    """
+
+    def __init__(self, capacity=8, channel_sum=True, device=None):
+        """
+        :param capacity: number of past explanations that are kept
+        :param channel_sum: store the relevance summed over the channels of each layer
+        :param device: device of the buffers, defaults to the device of the relevance
+        """
+        self.capacity = capacity
+        self.channel_sum = channel_sum
+        self.device = device
+        self.buffers = {}
+        self.count = 0
+        self.slot = -1
+
+    def begin(self, relevance):
+        self.slot = self.count % self.capacity
+        self.count += 1
+
+    def after(self, name, relevance):
+        shape = (relevance.size(0), 1) + tuple(relevance.shape[2:]) if self.channel_sum else tuple(relevance.shape)
+        buffer = self.buffers.get(name)
+        if buffer is None or tuple(buffer.shape[1:]) != shape:
+            if buffer is not None:
+                # explanations of a different shape can not be kept next to each other
+                self.reset()
+                self.begin(relevance)
+            buffer = torch.zeros((self.capacity,) + shape, dtype=relevance.dtype,
+                                 device=self.device or relevance.device)
+            self.buffers[name] = buffer
+
+        with torch.no_grad():
+            if self.channel_sum and buffer.device == relevance.device:
+                torch.sum(relevance, 1, keepdim=True, out=buffer[self.slot])
+            elif self.channel_sum:
+                buffer[self.slot].copy_(torch.sum(relevance, 1, keepdim=True))
+            else:
+                buffer[self.slot].copy_(relevance)
+
+    def reset(self):
+        self.buffers = {}
+        self.count = 0
+        self.slot = -1
+
+    def names(self):
+        return list(self.buffers.keys())
+
+    def latest(self, name):
+        """
+        Relevance of layer name in the last relprop call
+        """
+        return self.buffers[name][self.slot]
+
+    def history(self, name):
+        """
+        Relevance of layer name in the kept relprop calls, oldest first
+        """
+        kept = min(self.count, self.capacity)
+        order = [(self.count - kept + i) % self.capacity for i in range(kept)]
+        return self.buffers[name][order]
+
+
+class RelpropProfiler(RelpropObserver):
+    """
+    Records for every layer and relprop call the relevance sum entering and leaving the layer,
+    the wall clock time and the peak memory: on cuda the peak allocated memory of the layer, on the cpu the peak
+    resident memory of the process so far, which only grows in the layers that need more memory than any before.
+    Every layer synchronises with the device to read the sums, so only attach it while profiling.
+    """
+
+    COLUMNS = ('sum_in', 'sum_out', 'conservation_error', 'time', 'peak_memory')
+
+    def __init__(self):
+        self.records = []
+        self.calls = 0
+        self._start = None
+        self._sum_in = None
+
+    def begin(self, relevance):
+        self.calls += 1
+
+    def before(self, name, relevance):
+        if relevance.is_cuda:
+            torch.cuda.synchronize(relevance.device)
+            torch.cuda.reset_peak_memory_stats(relevance.device)
+        self._sum_in = relevance.sum().item()
+        self._start = time.perf_counter()
+
+    def after(self, name, relevance):
+        if relevance.is_cuda:
+            torch.cuda.synchronize(relevance.device)
+            peak_memory = torch.cuda.max_memory_allocated(relevance.device)
+        else:
+            peak_memory = peak_resident_memory()
+        elapsed = time.perf_counter() - self._start
+        sum_out = relevance.sum().item()
+        self.records.append({
+            'call': self.calls,
+            'layer': name,
+            'sum_in': self._sum_in,
+            'sum_out': sum_out,
+            'conservation_error': (sum_out - self._sum_in) / abs(self._sum_in) if self._sum_in != 0 else 0.0,
+            'time': elapsed,
+            'peak_memory': peak_memory,
+        })
+
+    def reset(self):
+        self.records = []
+        self.calls = 0
+
+    def summary(self):
+        """
+        Mean of every column per layer over all recorded calls, in relprop order
+        """
+        layers = OrderedDict()
+        for record in self.records:
+            layers.setdefault(record['layer'], []).append(record)
+        summary = OrderedDict()
+        for layer, records in layers.items():
+            summary[layer] = {}
+            for column in RelpropProfiler.COLUMNS:
+                values = [record[column] for record in records if record[column] is not None]
+                summary[layer][column] = sum(values) / len(values) if values else None
+        return summary
+
+    def table(self):
+        """
+        Per layer summary as a printable table
+        """
+        lines = ['{:<8}{:>14}{:>14}{:>14}{:>12}{:>14}'.format('layer', 'sum in', 'sum out', 'rel. error',
+                                                                'time [ms]', 'peak [MB]')]
+        for layer, values in self.summary().items():
+            peak = '-' if values['peak_memory'] is None else '{:.1f}'.format(values['peak_memory'] / 2 ** 20)
+            lines.append('{:<8}{:>14.6g}{:>14.6g}{:>14.3e}{:>12.3f}{:>14}'.format(
+                layer, values['sum_in'], values['sum_out'], values['conservation_error'], values['time'] * 1000,
+                peak))
+        return '\n'.join(lines)
+
+
+def peak_resident_memory():
+    """
+    Peak resident memory of this process in bytes, None where it cannot be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -6,7 +6,6 @@ import shutil
 import sys
 import random
 import torch
-import torch.nn as nn
 import torch.nn.parallel
 import torch.nn.functional as F
 import torch.backends.cudnn as cudnn
@@ -20,7 +19,7 @@ import torch.distributions as distr
 import models._DRAGAN as dcgm
 from utils import utils
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
+from utils.activation_maximization import SnapshotWriter, maximize_activation
 import subprocess
 import errno
 import matplotlib.pyplot as plt
@@ -41,6 +40,13 @@ group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument('--loadG', default=None, help='path to generator')
 group.add_argument('--loadD', default=None, help='path to discriminator')
 parser.add_argument('--alpha', default=1, type=int)
+parser.add_argument('--starts', help='number of starting images optimised at once', default=1, type=int)
+parser.add_argument('--init', help='starting images, ones is a white image', default='ones', choices=['ones', 'noise'])
+parser.add_argument('--step_size', default=0.007, type=float)
+parser.add_argument('--threshold', help='an image stops once its score reaches threshold', default=0.95, type=float)
+parser.add_argument('--max_steps', default=10000, type=int)
+parser.add_argument('--relevance_every', help='save a heatmap every n steps, 0 only saves the final one', default=0,
+                    type=int)
 
 opt = parser.parse_args()
 outf = '{}/{}'.format(opt.outf, os.path.splitext(os.path.basename(sys.argv[0]))[0])
@@ -61,6 +67,9 @@ except OSError as e:
 logger = Logger(model_name='LRPGAN', data_name=opt.dataset, dir_name=outf, make_fresh=False)
 print('Created Logger')
 
+# figures are only written to disk, from a background thread
+plt.switch_backend('agg')
+
 # CUDA everything
 cudnn.benchmark = True
 gpu = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
@@ -88,32 +97,29 @@ discriminator.passBatchNormParametersToConvolution()
 discriminator.removeBatchNormLayers()
 discriminator.eval()
 
-original_data = torch.randn(1, 3, opt.imageSize, opt.imageSize, device=gpu)
-original_data = torch.zeros(original_data.size()).fill_(1)
+if opt.init == 'ones':
+    original_data = torch.ones(opt.starts, 3, opt.imageSize, opt.imageSize, device=gpu)
+else:
+    original_data = torch.rand(opt.starts, 3, opt.imageSize, opt.imageSize, device=gpu) * 2 - 1
 original_data = F.pad(original_data, (p, p, p, p), value=-1)
-original_data.requires_grad = True
-score = torch.zeros(1)
-criterion = nn.BCELoss()
 
-i = 0
-while score.item() < 0.95:
-    result, prob = discriminator(original_data)
-    score = prob
-    test_relevance = discriminator.relprop()
-    test_relevance = torch.sum(test_relevance, 1, keepdim=True)
-    test_relevance = test_relevance[:, :, p:-p, p:-p]
-    print_data = original_data[:, :, p:-p, p:-p]
+snapshots = SnapshotWriter()
 
-    logger.save_heatmap_batch(images=print_data, relevance=test_relevance, probability=prob, relu_result=result,
-                              num=i)
 
-    loss = criterion(prob, torch.zeros(1))
-    gradient = torch.autograd.grad(loss, original_data)[0]
-    nu = torch.sign(gradient)
-    original_data = original_data + 0.007 * nu
-    logger.save_image_batch(gradient, num=i)
-    print('Score: {}, under 0.95: {}'.format(score.item(), score.item() < 0.95))
+def save_snapshot(step, images, probability, relevance):
+    relevance = torch.sum(relevance, 1, keepdim=True)[:, :, p:-p, p:-p]
+    print_data = images[:, :, p:-p, p:-p]
+    snapshots.submit(logger.save_heatmap_batch, images=print_data, relevance=relevance, probability=probability,
+                     relu_result=probability, num=step)
 
-    i += 1
 
+images, probability, steps, relevance = maximize_activation(discriminator, original_data, step_size=opt.step_size,
+                                                            threshold=opt.threshold, max_steps=opt.max_steps,
+                                                            relevance_every=opt.relevance_every,
+                                                            callback=save_snapshot)
+snapshots.submit(logger.save_image_batch, images[:, :, p:-p, p:-p].cpu(), num=None)
+snapshots.close()
 
+for n in range(images.size(0)):
+    print('Start {}: score {} after {} steps, over {}: {}'.format(n, probability[n].item(), steps[n].item(),
+                                                                 opt.threshold, probability[n].item() >= opt.threshold))
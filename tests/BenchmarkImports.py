@@ -0,0 +1,69 @@
+# imports
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+from utils.benchmark import BenchmarkHistory, format_comparison
+
+'''
+    Import time of the library modules, every import runs in a fresh interpreter.
+    torch is measured as well, it is the floor none of the other modules can go below.
+'''
+
+MODULES = ['torch', 'utils.utils', 'utils.metrics', 'utils.evaluation', 'utils.explain', 'utils.sampling',
+           'utils.datasets', 'models._DRAGAN', 'models._DCGAN', 'modules.ModuleRedefinitions', 'lrpgan']
+
+# optional dependencies that should only be imported when they are used
+HEAVY = ['matplotlib', 'tensorboardX', 'IPython', 'torchvision', 'mpl_toolkits']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'heavy': sorted(name for name in {heavy} if name in sys.modules)}}))
+'''
+
+
+def import_time(module, root):
+    output = subprocess.check_output([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)], cwd=root,
+                                     env=dict(os.environ, PYTHONPATH=root), stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the library modules')
+    parser.add_argument('--modules', default=','.join(MODULES), help='comma separated modules to import')
+    parser.add_argument('--repeat', type=int, default=5, help='imports per module, the median is reported')
+    parser.add_argument('--history', default='benchmarks/imports.json', help='json file collecting all runs')
+    parser.add_argument('--save_baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as regression')
+    opt = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for module in opt.modules.split(','):
+        runs = [import_time(module, root) for _ in range(opt.repeat)]
+        results['import/{}'.format(module)] = sorted(run['seconds'] for run in runs)[len(runs) // 2]
+        print('{:<40} {:10.1f} ms   loads {}'.format(module, results['import/{}'.format(module)] * 1000,
+                                                    ', '.join(runs[0]['heavy']) or '-'))
+        sys.stdout.flush()
+
+    history = BenchmarkHistory(opt.history)
+    comparison = history.compare(results, opt.tolerance)
+    history.append(results, save_baseline=opt.save_baseline)
+
+    if comparison:
+        print(format_comparison(comparison))
+        regressions = [name for name, _, _, _, regressed in comparison if regressed]
+        print('{} of {} imports slower than the baseline by more than {:.0%}'.format(len(regressions),
+                                                                                    len(comparison),
+                                                                                    opt.tolerance))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
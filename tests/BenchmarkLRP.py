@@ -0,0 +1,135 @@
+# imports
+from __future__ import print_function
+import argparse
+import copy
+import re
+import sys
+import torch
+import torch.nn.functional as F
+import numpy as np
+import models._DRAGAN as dcgm
+import modules.ModuleRedefinitions as nnrd
+from utils import utils
+from utils.benchmark import BenchmarkHistory, format_comparison, measure
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def layer_cases(batch_size, ndf, image_size):
+    """
+    (name, layer, input shape) for every layer type
+    """
+    size = image_size // 2
+    return [
+        ('FirstConvolution', nnrd.FirstConvolution(3, ndf, kernel_size=3, stride=1, padding=0),
+         (batch_size, 3, image_size + 2, image_size + 2)),
+        ('NextConvolution', nnrd.NextConvolution(ndf, ndf * 2, kernel_size=4, name='0', stride=2, padding=1, alpha=1),
+         (batch_size, ndf, size, size)),
+        ('NextConvolutionEps', nnrd.NextConvolutionEps(ndf, ndf * 2, kernel_size=4, name='0', stride=2, padding=1,
+                                                       epsilon=0.01),
+         (batch_size, ndf, size, size)),
+        ('LastConvolutionEps', nnrd.LastConvolutionEps(ndf * 8, 1, kernel_size=4, name='4', stride=1, padding=0,
+                                                       epsilon=0.01),
+         (batch_size, ndf * 8, 4, 4)),
+        ('NextLinear', nnrd.NextLinear(ndf * 8, ndf), (batch_size, ndf * 8)),
+        ('Pooling', nnrd.Pooling(2), (batch_size, ndf, size, size)),
+    ]
+
+
+def forward_relprop(layer, shape):
+    x = (torch.rand(shape) * 2 - 1).requires_grad_()
+    if not isinstance(layer, nnrd.FirstConvolution):
+        x = F.relu(x).detach().requires_grad_()
+    output = layer(x)
+    return layer.relprop(output.detach().clamp(min=0))
+
+
+def canonical(network, nc, ndf):
+    discriminator = network(nc, ndf, 1)
+    discriminator.passBatchNormParametersToConvolution()
+    discriminator.removeBatchNormLayers()
+    discriminator.eval()
+    return discriminator
+
+
+def network_relevance(discriminator, x):
+    discriminator(x.detach().requires_grad_(), flip=False)
+    return discriminator.relprop(flip=False)
+
+
+def run(opt):
+    results = {}
+    pattern = re.compile(opt.filter) if opt.filter else None
+
+    def bench(name, fn, setup=None):
+        if pattern is not None and not pattern.search(name):
+            return
+        results[name] = measure(fn, repeat=opt.repeat, warmup=1, setup=setup)['median']
+        print('{:<60} {:10.3f} ms'.format(name, results[name] * 1000))
+        sys.stdout.flush()
+
+    for batch_size in opt.batch_sizes:
+        for ndf in opt.ndfs:
+            for image_size in opt.image_sizes:
+                suffix = 'b{}_ndf{}_s{}'.format(batch_size, ndf, image_size)
+                for name, layer, shape in layer_cases(batch_size, ndf, image_size):
+                    bench('layer/{}/{}'.format(name, suffix), lambda: forward_relprop(layer, shape))
+
+                # the discriminators reduce 64 x 64 inputs to a single output
+                if image_size % 64 != 0:
+                    continue
+                for network in (dcgm.DiscriminatorNetLessCheckerboardToCanonical, dcgm.SmoothingLayerDiscriminator):
+                    discriminator = canonical(network, 3, ndf)
+                    x = F.pad(torch.rand(batch_size, 3, image_size, image_size) * 2 - 1, (1, 1, 1, 1),
+                              mode='replicate')
+                    bench('net/{}/forward_relprop/{}'.format(network.__name__, suffix),
+                          lambda: network_relevance(discriminator, x))
+                    bench('net/{}/score/{}'.format(network.__name__, suffix), lambda: discriminator.score(x))
+
+                    template = network(3, ndf, 1)
+                    bench('canonicalize/{}/ndf{}'.format(network.__name__, ndf),
+                          lambda d: (d.passBatchNormParametersToConvolution(), d.removeBatchNormLayers()),
+                          setup=lambda: copy.deepcopy(template))
+
+        # visualize renders at most 16 maps at once, in the N x 1 x H x W layout of Logger.log_images
+        relevance = np.random.randn(min(batch_size, 16), 1, opt.image_sizes[-1], opt.image_sizes[-1])
+        bench('heatmap/b{}_s{}'.format(min(batch_size, 16), opt.image_sizes[-1]),
+              lambda: utils.visualize(relevance, utils.heatmap))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark relevance propagation on the cpu')
+    parser.add_argument('--batch_sizes', type=int_list, default=[1, 16])
+    parser.add_argument('--ndfs', type=int_list, default=[16, 64])
+    parser.add_argument('--image_sizes', type=int_list, default=[32, 64])
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case, the median is reported')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads, default torch default')
+    parser.add_argument('--filter', default=None, help='only run cases whose name matches this regex')
+    parser.add_argument('--history', default='benchmarks/lrp.json', help='json file collecting all runs')
+    parser.add_argument('--save_baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as regression')
+    opt = parser.parse_args()
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    torch.manual_seed(1234)
+
+    history = BenchmarkHistory(opt.history)
+    results = run(opt)
+    comparison = history.compare(results, opt.tolerance)
+    history.append(results, save_baseline=opt.save_baseline)
+
+    if comparison:
+        print(format_comparison(comparison))
+        regressions = [name for name, _, _, _, regressed in comparison if regressed]
+        print('{} of {} cases slower than the baseline by more than {:.0%}'.format(len(regressions), len(comparison),
+                                                                                   opt.tolerance))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# imports
+from __future__ import print_function
+import argparse
+import sys
+import torch
+import torch.nn.functional as F
+import models._DRAGAN as dcgm
+
+'''
+    Checks the score() fast path of the canonical discriminators against forward() and that its cached folded
+    weights can be differentiated through after a score() in inference mode.
+'''
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit('FAILED: {}'.format(message))
+    print('ok: {}'.format(message))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nc', type=int, default=3)
+    parser.add_argument('--ndf', type=int, default=16)
+    parser.add_argument('--batch_size', type=int, default=4)
+    opt = parser.parse_args()
+
+    torch.manual_seed(1234)
+    discriminator = dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc=opt.nc, alpha=1, ndf=opt.ndf, ngpu=1)
+    discriminator.eval()
+    x = F.pad(torch.rand(opt.batch_size, opt.nc, 64, 64) * 2 - 1, (1, 1, 1, 1), mode='replicate')
+
+    # the first score() builds the folded weights in inference mode
+    probability = discriminator.score(x)
+    _, expected = discriminator(x.clone())
+    check(torch.allclose(probability, expected.detach(), atol=1e-6), 'score equals the probability of forward')
+
+    images = x.clone().requires_grad_()
+    discriminator.score(images, grad=True).sum().backward()
+    check(images.grad is not None and torch.isfinite(images.grad).all().item(),
+          'score(grad=True) after score() backpropagates')
+
+    # weights changed inside an inference mode of the caller
+    with torch.no_grad():
+        for parameter in discriminator.parameters():
+            parameter.mul_(0.9)
+    with torch.inference_mode():
+        discriminator.score(x)
+    images = x.clone().requires_grad_()
+    discriminator.score(images, grad=True).sum().backward()
+    check(images.grad is not None, 'score(grad=True) after a weight update and score() in inference mode')
+
+
+if __name__ == '__main__':
+    main()
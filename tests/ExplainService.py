@@ -0,0 +1,86 @@
+# imports
+from __future__ import print_function
+import argparse
+import io
+import os
+import sys
+import tempfile
+import threading
+import urllib.request
+import numpy as np
+import PIL.Image
+import torch
+import models._DRAGAN as dcgm
+from utils.explain import Explainer
+from utils.explain_service import relevance_png, serve
+
+'''
+    Starts the relevance service on a free localhost port and checks a png and a npy round trip against
+    Explainer.explain. Without --loadD a randomly initialized discriminator is served.
+'''
+
+
+def post(url, body):
+    response = urllib.request.urlopen(urllib.request.Request(url, data=body, method='POST'), timeout=60)
+    return response.read(), response.headers
+
+
+def check(condition, message):
+    if not condition:
+        sys.exit('FAILED: {}'.format(message))
+    print('ok: {}'.format(message))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--loadD', default=None, help='path to discriminator, default a random one')
+    parser.add_argument('--nc', type=int, default=3)
+    parser.add_argument('--ndf', type=int, default=16)
+    parser.add_argument('--imageSize', type=int, default=64)
+    opt = parser.parse_args()
+
+    torch.manual_seed(1234)
+    checkpoint = opt.loadD
+    if checkpoint is None:
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'discriminator.pth')
+        torch.save(dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc=opt.nc, alpha=1, ndf=opt.ndf, ngpu=1)
+                   .state_dict(), checkpoint)
+    explainer = Explainer(checkpoint, nc=opt.nc, ndf=opt.ndf, image_size=opt.imageSize, device=torch.device('cpu'))
+
+    # port 0 lets the system pick a free port
+    server = serve(explainer, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    try:
+        check(urllib.request.urlopen(url + '/health', timeout=60).read() == b'ok', 'health')
+
+        # raw array in, raw array out
+        image = torch.rand(opt.nc, opt.imageSize, opt.imageSize) * 2 - 1
+        buffer = io.BytesIO()
+        np.save(buffer, image.numpy())
+        body, headers = post(url + '/explain?format=npy', buffer.getvalue())
+        relevance = np.load(io.BytesIO(body), allow_pickle=False)
+        expected, probability = explainer.explain(image.unsqueeze(0))
+        check(relevance.shape == (opt.imageSize, opt.imageSize), 'npy relevance shape {}'.format(relevance.shape))
+        check(np.allclose(relevance, expected[0].numpy(), atol=1e-5), 'npy relevance equals Explainer.explain')
+        check(abs(float(headers['X-Probability']) - probability.item()) < 1e-5, 'probability header')
+
+        # png in, heatmap png out
+        image = PIL.Image.fromarray((np.random.RandomState(0).rand(opt.imageSize, opt.imageSize, 3) * 255)
+                                    .astype(np.uint8), 'RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        body, headers = post(url + '/explain?format=png', buffer.getvalue())
+        check(headers['Content-Type'] == 'image/png', 'png content type')
+        heatmap = PIL.Image.open(io.BytesIO(body))
+        check(heatmap.size == (opt.imageSize, opt.imageSize), 'png heatmap size {}'.format(heatmap.size))
+        expected, _ = explainer.explain(explainer.preprocess(image).unsqueeze(0))
+        check(body == relevance_png(expected[0]), 'png heatmap equals the heatmap of Explainer.explain')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
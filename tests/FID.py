@@ -0,0 +1,33 @@
+# imports
+from __future__ import print_function
+import argparse
+from utils.evaluation import evaluate_epochs
+from utils.metrics import FrechetDistance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--genfolder', required=True, help='checkpoint folder or checkpoint archive')
+    parser.add_argument('--epochs', required=True)
+    parser.add_argument('--num_images', type=int, default=10000)
+    parser.add_argument('--batch_size', type=int, default=500)
+    parser.add_argument('--dataset_root', default='../dataset', help='MNIST location, real statistics are cached there')
+    parser.add_argument('--filename')
+    parser.add_argument('--workers', type=int, default=None, help='number of evaluation processes, default one per cpu')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads per evaluation process')
+    opt = parser.parse_args()
+
+    metric = FrechetDistance(opt.genfolder, num_images=opt.num_images, batch_size=opt.batch_size,
+                             root=opt.dataset_root)
+    results = evaluate_epochs(metric, range(int(opt.epochs)), '{}/{}.jsonl'.format('./', opt.filename),
+                              workers=opt.workers, threads=opt.threads)
+    summary = metric.summary(results)
+    print(summary)
+
+    text_file = open("{}/{}.txt".format('./', opt.filename), "w+")
+    text_file.write(summary + '\n')
+    text_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,10 +20,9 @@ import torch.distributions as distr
 import models._DRAGAN as dcgm
 from utils import utils
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
+from utils.sampling import PNGWriter, stream_samples
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 import utils.ciphar10 as ciphar10
 
@@ -41,6 +40,7 @@ parser.add_argument('--loadG', default=None, help='path to generator')
 parser.add_argument('--loadD', default=None, help='path to discriminator')
 parser.add_argument('--alpha', default=1, type=int)
 parser.add_argument('--external', help='load external network', action='store_true')
+parser.add_argument('--save_images', help='write the generated images as png files', action='store_true')
 
 opt = parser.parse_args()
 outf = '{}/{}'.format(opt.outf, os.path.splitext(os.path.basename(sys.argv[0]))[0])
@@ -86,11 +86,6 @@ generator.load_state_dict(dict)
 generator.to(gpu)
 generator.eval()
 
-noise = torch.randn(opt.num_images, nz, 1, 1, device=gpu)
-
-images = generator(noise)
-# logger.save_image_batch(images, num=None)
-
 root_dir = 'dataset/custom'
 dataset = datasets.ImageFolder(root=root_dir, transform=transforms.Compose(
     [
@@ -115,7 +110,15 @@ discriminator.load_state_dict(dict)
 discriminator.to(gpu)
 discriminator.eval()
 
-results_generated = discriminator(images)
+# samples are generated in chunks of batchSize with the batch norm folded generator
+results_generated = []
+writer = PNGWriter('{}/{}/png'.format(logger.data_subdir, 'generated')) if opt.save_images else None
+with torch.no_grad():
+    stream_samples(generator, opt.num_images, writer, chunk_size=opt.batchSize, nz=nz, seed=1234, device=gpu,
+                   callback=lambda start, images: results_generated.append(discriminator(images)))
+if writer is not None:
+    writer.close()
+results_generated = torch.cat(results_generated)
 
 for n_batch, (batch_data, _) in enumerate(dataloader, 0):
     results_loaded = discriminator(batch_data)
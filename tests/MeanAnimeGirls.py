@@ -20,10 +20,8 @@ import torch.distributions as distr
 import models._DRAGAN as dcgm
 from utils import utils
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 import utils.ciphar10 as ciphar10
 
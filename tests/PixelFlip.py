@@ -18,11 +18,13 @@ import torchvision.utils as vutils
 import torch.distributions as distr
 import models._DRAGAN as dcgm
 import utils.utils as utils
+import utils.tuning as tuning
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
+from utils.checkpoint import state_dict_fingerprint
+from utils.explain import relevance
+from utils.relevance_cache import RelevanceCache, rule_config
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 import utils.ciphar10 as ciphar10
 
@@ -45,6 +47,8 @@ parser.add_argument('--k', help='Number of pixels to flip', type=int, default=No
 parser.add_argument('--p', help='Percent of pixels to flip', type=int)
 parser.add_argument('--highest', action='store_true')
 parser.add_argument('--filename')
+parser.add_argument('--relevance_cache', default=None, help='folder to cache relevance maps in between runs')
+parser.add_argument('--cache_size', default=1024, type=int, help='size of the relevance cache in MB')
 opt = parser.parse_args()
 ngpu = int(opt.ngpu)
 opt.imageSize = 64
@@ -172,10 +176,27 @@ discriminator.passBatchNormParametersToConvolution()
 discriminator.removeBatchNormLayers()
 discriminator.eval()
 
+# threads, oneDNN and memory format of the cpu profile of this machine, see utils/tuning.py
+if not torch.cuda.is_available():
+    tuning.apply_profile('explain', discriminator)
+
 dataloader = torch.utils.data.DataLoader(dataset, batch_size=1,
                                          shuffle=False, num_workers=0)
 
 flip = True
+fingerprint = state_dict_fingerprint(discriminator.state_dict())
+cache = RelevanceCache(opt.relevance_cache, max_bytes=opt.cache_size << 20) if opt.relevance_cache else None
+
+
+def get_relevance(images, prob):
+    # relevance of confidently real images is propagated without flipping the last layer
+    use_flip = False if prob.item() > 0.5 else flip
+    if cache is None:
+        return relevance(discriminator, images, use_flip)
+    return cache.relevance(images, fingerprint, rule_config(discriminator, use_flip),
+                           lambda missing: relevance(discriminator, missing, use_flip))
+
+
 all_before_scores = []
 all_after_scores = []
 highest = opt.highest
@@ -195,14 +216,10 @@ for percent in range(0, opt.p):
         batch_data = F.pad(batch_data, (p, p, p, p), mode='replicate')
         batch_data.requires_grad = True
 
-        test_result, test_prob = discriminator(batch_data, flip=flip)
-        before_score.append(test_prob.detach().item())
-
-        if test_prob.detach().item() > 0.5:
-            test_result, test_prob = discriminator(batch_data, flip=False)
-            test_relevance = discriminator.relprop(flip=False)
-        else:
-            test_relevance = discriminator.relprop(flip=flip)
+        test_prob = discriminator.score(batch_data)
+        test_result = test_prob
+        before_score.append(test_prob.item())
+        test_relevance = get_relevance(batch_data, test_prob)
 
         test_relevance = torch.sum(test_relevance, 1, keepdim=True)
 
@@ -222,14 +239,10 @@ for percent in range(0, opt.p):
 
         flipped_image = F.pad(flipped_image, (p, p, p, p), mode='replicate')
 
-        test_result, test_prob = discriminator(flipped_image, flip=flip)
-        after_score.append(test_prob.detach().item())
-
-        if test_prob.detach().item() > 0.5:
-            test_result, test_prob = discriminator(flipped_image, flip=False)
-            test_relevance = discriminator.relprop(flip=False)
-        else:
-            test_relevance = discriminator.relprop(flip=flip)
+        test_prob = discriminator.score(flipped_image)
+        test_result = test_prob
+        after_score.append(test_prob.item())
+        test_relevance = get_relevance(flipped_image, test_prob)
 
         test_relevance = torch.sum(test_relevance, 1, keepdim=True)
 
@@ -261,3 +274,7 @@ for percent in range(0, opt.p):
     text_file = open("{}/{}_highest_{}.txt".format(outf, opt.filename, opt.highest), "a+")
     text_file.write(f'{k} {before_score_mean} {after_score_mean}\n')
     text_file.close()
+
+if cache is not None:
+    cache.close()
+    print('Relevance cache: {} hits, {} misses'.format(cache.hits, cache.misses))
@@ -18,10 +18,8 @@ import torchvision.utils as vutils
 import torch.distributions as distr
 import models._DRAGAN as dcgm
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 from torch.utils.serialization import load_lua
 import torchfile
@@ -20,10 +20,9 @@ import torch.distributions as distr
 import models._DRAGAN as dcgm
 from utils import utils
 from utils.utils import Logger
-from utils.utils import MidpointNormalize
+from utils.sampling import PNGWriter, stream_samples
 import subprocess
 import errno
-import matplotlib.pyplot as plt
 import numpy as np
 import utils.ciphar10 as ciphar10
 
@@ -328,8 +327,6 @@ if opt.loadG and opt.external:
     generator.to(gpu)
     generator.eval()
 
-    noise = torch.randn(opt.num_images, nz, 1, 1, device=gpu)
-
-    images = generator(noise)
-
-    logger.save_image_batch(images, num=None)
+    writer = PNGWriter('{}/{}/png'.format(logger.data_subdir, 'generated'))
+    stream_samples(generator, opt.num_images, writer, chunk_size=opt.batchSize, nz=nz, seed=1234, device=gpu)
+    writer.close()
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from utils.explain import relevance
+
+'''
+    Batched activation maximization for the canonical discriminators
+'''
+
+
+class SnapshotWriter:
+    """
+    Runs snapshot functions (figures, images) in a background thread so the optimisation does not wait for them.
+    Tensors are expected to be detached cpu copies.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.pending = [future for future in self.pending if not future.done()] + \
+                       [self.executor.submit(fn, *args, **kwargs)]
+
+    def close(self):
+        for future in self.pending:
+            # re-raise errors of the background writes
+            future.result()
+        self.executor.shutdown()
+
+
+def maximize_activation(discriminator, images, step_size=0.001, threshold=0.8, max_steps=10000,
+                        relevance_every=0, callback=None, flip=True):
+    """
+    Sign gradient ascent on the probability of the discriminator for a batch of starting images.
+    Every image stops as soon as its probability reaches threshold, only images still below it are
+    forwarded in the next step.
+    :param discriminator: discriminator with a score method, in eval mode
+    :param images: batch of starting images
+    :param relevance_every: compute the relevance every n steps, 0 only computes it at the end
+    :param callback: called with (step, images, probability, relevance) as detached cpu tensors whenever the
+                     relevance was computed
+    :return: final images, their probability, the number of steps per image and the final relevance
+    """
+    images = images.detach().clone()
+    probability = torch.zeros(images.size(0), device=images.device)
+    steps = torch.zeros(images.size(0), dtype=torch.long, device=images.device)
+    active = torch.arange(images.size(0), device=images.device)
+
+    step = 0
+    while active.numel() > 0 and step < max_steps:
+        x = images[active].requires_grad_()
+        prob = discriminator.score(x, grad=True)
+        gradient = torch.autograd.grad(prob.sum(), x)[0]
+
+        with torch.no_grad():
+            probability[active] = prob.detach()
+            done = prob.detach() >= threshold
+            # images that reached the threshold keep the input they reached it with
+            update = active[~done]
+            images[update] += step_size * torch.sign(gradient[~done])
+            steps[update] += 1
+            active = update
+        step += 1
+
+        if relevance_every > 0 and step % relevance_every == 0 and callback is not None:
+            callback(step, images.cpu(), probability.cpu(), relevance(discriminator, images, flip).cpu())
+
+    final_relevance = relevance(discriminator, images, flip)
+    with torch.no_grad():
+        probability = discriminator.score(images)
+    if callback is not None:
+        callback(step, images.cpu(), probability.cpu(), final_relevance.cpu())
+    return images, probability, steps, final_relevance
@@ -0,0 +1,93 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import torch
+
+'''
+    Timing helpers and a json benchmark history with a stored baseline.
+    History file layout:
+        {"baseline": {"environment": {...}, "results": {name: seconds}}, "runs": [{"environment": ..., "results": ...}]}
+'''
+
+
+def measure(fn, repeat=5, warmup=1, setup=None):
+    """
+    :param fn: function to time, gets the return value of setup if given
+    :param setup: called before every run, not timed
+    :return: dict with min, median and mean seconds over repeat runs
+    """
+    times = []
+    for i in range(warmup + repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(argument) if setup is not None else fn()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times)}
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'torch': torch.__version__,
+            'python': platform.python_version(), 'machine': platform.machine(), 'threads': torch.get_num_threads()}
+
+
+class BenchmarkHistory:
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {'baseline': None, 'runs': []}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    @property
+    def baseline(self):
+        return self.data['baseline']['results'] if self.data['baseline'] else None
+
+    def append(self, results, save_baseline=False):
+        """
+        :param results: {name: seconds}
+        :param save_baseline: also store results as the new baseline
+        """
+        run = {'environment': environment(), 'results': results}
+        self.data['runs'].append(run)
+        if save_baseline or self.data['baseline'] is None:
+            self.data['baseline'] = run
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+    def compare(self, results, tolerance=0.1):
+        """
+        :param tolerance: relative slowdown that still counts as unchanged
+        :return: list of (name, baseline seconds, seconds, ratio, regressed) for names in both
+        """
+        baseline = self.baseline or {}
+        comparison = []
+        for name, seconds in results.items():
+            if name in baseline:
+                ratio = seconds / baseline[name] if baseline[name] > 0 else float('inf')
+                comparison.append((name, baseline[name], seconds, ratio, ratio > 1 + tolerance))
+        return comparison
+
+
+def format_comparison(comparison):
+    width = max([len(name) for name, *_ in comparison] + [4])
+    lines = ['{:<{w}}{:>14}{:>14}{:>9}'.format('case', 'baseline [ms]', 'current [ms]', 'ratio', w=width)]
+    for name, baseline, seconds, ratio, regressed in comparison:
+        lines.append('{:<{w}}{:>14.3f}{:>14.3f}{:>9.2f}{}'.format(name, baseline * 1000, seconds * 1000, ratio,
+                                                                  '  REGRESSION' if regressed else '', w=width))
+    return '\n'.join(lines)
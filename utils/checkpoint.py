@@ -0,0 +1,214 @@
+import atexit
+import hashlib
+import os
+import queue
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.utils.data
+
+'''
+    Checkpoints are written as <name>.pth with a <name>.pth.sha256 file next to them
+'''
+
+CHECKSUM_SUFFIX = '.sha256'
+
+
+class _HashingWriter:
+    """
+    File-like wrapper that feeds every written chunk into a checksum
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints from a background thread so the training loop does not wait for the disk.
+    State dicts are copied to the cpu when they are queued, so training can keep updating the weights.
+    Every file is written to a temporary file first and renamed once it is complete, the sha256 of the
+    written bytes is stored next to it.
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, obj, path):
+        """
+        Snapshot obj (state dict or a dict of them) and queue it for writing to path
+        """
+        self._raise_error()
+        self.queue.put((snapshot(obj), path))
+
+    def wait(self):
+        """
+        Block until all queued checkpoints are on disk
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.join()
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    write_checkpoint(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+def snapshot(obj):
+    """
+    Detached cpu copy of all tensors in obj
+    """
+    if torch.is_tensor(obj):
+        if obj.device.type == 'cpu':
+            return obj.detach().clone()
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, OrderedDict):
+        return OrderedDict((key, snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return obj
+
+
+def write_checkpoint(obj, path):
+    """
+    Atomically write obj to path and return its sha256
+    """
+    directory = os.path.dirname(path) or '.'
+    tmp_path = os.path.join(directory, '.{}.tmp'.format(os.path.basename(path)))
+
+    with open(tmp_path, 'wb') as f:
+        writer = _HashingWriter(f)
+        torch.save(obj, writer)
+        f.flush()
+        os.fsync(f.fileno())
+        if os.fstat(f.fileno()).st_size != writer.size:
+            raise IOError('Checkpoint {} was not completely written'.format(path))
+    digest = writer.hash.hexdigest()
+
+    with open(tmp_path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write('{}  {}\n'.format(digest, os.path.basename(path)))
+
+    os.replace(tmp_path, path)
+    os.replace(tmp_path + CHECKSUM_SUFFIX, path + CHECKSUM_SUFFIX)
+    return digest
+
+
+def verify_checkpoint(path, chunk_size=1 << 20):
+    """
+    Compare the checkpoint against the checksum stored while writing it.
+    Returns None if there is no checksum file.
+    """
+    try:
+        with open(path + CHECKSUM_SUFFIX) as f:
+            expected = f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+
+def state_dict_fingerprint(state_dict):
+    """
+    sha1 over names, dtypes, shapes and contents of all tensors in a state dict
+    """
+    digest = hashlib.sha1()
+    for key, value in state_dict.items():
+        digest.update('{} {} {}'.format(key, value.dtype, list(value.shape)).encode())
+        if value.numel() > 0:
+            digest.update(value.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_rng_state():
+    """
+    States of all random number generators used during training
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    numpy_state = (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian)
+    state = {'python': random.getstate(), 'numpy': numpy_state, 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, keys.cpu().numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(state['torch'].cpu())
+    if torch.cuda.is_available() and 'cuda' in state:
+        torch.cuda.set_rng_state_all([s.cpu() for s in state['cuda']])
+
+
+class ResumableRandomSampler(torch.utils.data.Sampler):
+    """
+    Shuffles the dataset with a permutation that only depends on seed and epoch,
+    so an epoch can be continued from any position after a restart.
+    __len__ always reports the full dataset so len(dataloader) stays the number of batches per epoch.
+    """
+
+    def __init__(self, data_source, seed=0):
+        self.data_source = data_source
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        """
+        :param epoch: epoch to draw the permutation for
+        :param start: number of samples of the permutation that were already seen
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        permutation = torch.randperm(len(self.data_source), generator=generator, device='cpu')
+        return iter(permutation[self.start:].tolist())
+
+    def __len__(self):
+        return len(self.data_source)
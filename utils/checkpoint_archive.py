@@ -0,0 +1,218 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+'''
+    Archive layout:
+        magic | tensor data (64 byte aligned) | json index | index offset + magic
+    Tensors with identical content are stored once and shared by all checkpoints using them.
+    Appending writes the new tensors, index and footer after the old footer, so the bytes of the old archive
+    never change. If an append is interrupted, the last complete footer is searched and the partial
+    append is discarded on the next append.
+'''
+
+MAGIC = b'LRPA0001'
+ALIGNMENT = 64
+_FOOTER = struct.Struct('<Q8s')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _dtype_name(dtype):
+    return str(dtype).replace('torch.', '')
+
+
+class CheckpointArchive:
+    """
+    Read access to a checkpoint archive. The file is memory mapped once, state dicts
+    are views into the mapping, so loading an epoch does not deserialize anything.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index, _, _ = _read_index(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode='c')
+        self._tensors = {}
+
+    def names(self):
+        return list(self.index['checkpoints'].keys())
+
+    def __contains__(self, name):
+        return name in self.index['checkpoints']
+
+    def state_dict(self, name):
+        if name not in self:
+            raise KeyError('Checkpoint {} is not in archive {}'.format(name, self.path))
+        return OrderedDict((key, self._tensor(digest))
+                           for key, digest in self.index['checkpoints'][name].items())
+
+    def _tensor(self, digest):
+        # Tensors shared between epochs are only created once
+        if digest not in self._tensors:
+            entry = self.index['tensors'][digest]
+            dtype = getattr(torch, entry['dtype'])
+            buffer = self.data[entry['offset']:entry['offset'] + entry['nbytes']]
+            tensor = torch.from_numpy(buffer)
+            if entry['nbytes'] > 0:
+                tensor = tensor.view(dtype)
+            else:
+                tensor = torch.empty(0, dtype=dtype)
+            self._tensors[digest] = tensor.reshape(entry['shape'])
+        return self._tensors[digest]
+
+
+class CheckpointFolder:
+    """
+    Same interface as CheckpointArchive for a folder of <name>.pth files
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def names(self):
+        return sorted(os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(self.path, '*.pth')))
+
+    def __contains__(self, name):
+        return os.path.isfile(os.path.join(self.path, '{}.pth'.format(name)))
+
+    def state_dict(self, name):
+        return torch.load(os.path.join(self.path, '{}.pth'.format(name)),
+                          map_location='cuda:0' if torch.cuda.is_available() else 'cpu')
+
+
+def open_checkpoints(path):
+    """
+    Open either a checkpoint archive or a checkpoint folder
+    """
+    if os.path.isfile(path):
+        return CheckpointArchive(path)
+    return CheckpointFolder(path)
+
+
+def pack(state_dicts, path):
+    """
+    Append checkpoints to an archive, creating it if necessary.
+    :param state_dicts: iterable of (name, state_dict)
+    :param path: archive file
+    """
+    if os.path.isfile(path):
+        index, _, end = _read_index(path)
+        mode = 'r+b'
+    else:
+        index, end = {'tensors': {}, 'checkpoints': {}}, len(MAGIC)
+        mode = 'w+b'
+
+    with open(path, mode) as f:
+        if mode == 'w+b':
+            f.write(MAGIC)
+        else:
+            # drops the remains of an interrupted append
+            f.truncate(end)
+        offset = end
+
+        for name, state_dict in state_dicts:
+            entries = OrderedDict()
+            for key, tensor in state_dict.items():
+                tensor = tensor.detach().cpu().contiguous()
+                data = tensor.reshape(-1).view(torch.uint8).numpy().tobytes() if tensor.numel() else b''
+                digest = hashlib.sha1(data + _dtype_name(tensor.dtype).encode() +
+                                      str(list(tensor.shape)).encode()).hexdigest()
+
+                if digest not in index['tensors']:
+                    offset = _align(offset)
+                    f.seek(offset)
+                    f.write(data)
+                    index['tensors'][digest] = {'offset': offset, 'nbytes': len(data),
+                                                'dtype': _dtype_name(tensor.dtype), 'shape': list(tensor.shape)}
+                    offset += len(data)
+                entries[key] = digest
+            index['checkpoints'][name] = entries
+
+        f.seek(offset)
+        f.write(json.dumps(index).encode())
+        f.write(_FOOTER.pack(offset, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def pack_folder(folder, path):
+    """
+    Add all <name>_epoch_<i>.pth files of a checkpoint folder that are not yet in the archive
+    """
+    existing = set(CheckpointArchive(path).names()) if os.path.isfile(path) else set()
+
+    def epoch_order(name):
+        match = re.search(r'_epoch_(\d+)$', name)
+        return (name[:match.start()], int(match.group(1))) if match else (name, -1)
+
+    names = sorted((name for name in CheckpointFolder(folder).names() if name not in existing), key=epoch_order)
+    checkpoints = CheckpointFolder(folder)
+    pack(((name, checkpoints.state_dict(name)) for name in names), path)
+    return names
+
+
+def _read_index(path):
+    """
+    :return: index, its offset and the end of its footer. Uses the last complete footer of the file.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a checkpoint archive'.format(path))
+        size = f.seek(0, os.SEEK_END)
+        index = _index_at(f, size)
+        if index is not None:
+            return index + (size,)
+
+        # an append was interrupted, search backwards for the footer it left behind
+        chunk = 1 << 20
+        position = size
+        while position > len(MAGIC):
+            start = max(len(MAGIC), position - chunk)
+            f.seek(start)
+            data = f.read(position - start + len(MAGIC) - 1)
+            found = data.rfind(MAGIC)
+            while found >= 0:
+                end = start + found + len(MAGIC)
+                index = _index_at(f, end)
+                if index is not None:
+                    return index + (end,)
+                found = data.rfind(MAGIC, 0, found)
+            position = start
+    raise ValueError('Checkpoint archive {} is incomplete'.format(path))
+
+
+def _index_at(f, end):
+    """
+    (index, index offset) if a valid footer ends at end, otherwise None
+    """
+    if end < len(MAGIC) + _FOOTER.size:
+        return None
+    f.seek(end - _FOOTER.size)
+    index_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+    if magic != MAGIC or not len(MAGIC) <= index_offset <= end - _FOOTER.size:
+        return None
+    f.seek(index_offset)
+    try:
+        return json.loads(f.read(end - _FOOTER.size - index_offset).decode()), index_offset
+    except ValueError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack a folder of epoch checkpoints into one archive')
+    parser.add_argument('folder', help='folder containing generator_epoch_<i>.pth / discriminator_epoch_<i>.pth')
+    parser.add_argument('archive', help='archive file to create or extend')
+    opt = parser.parse_args()
+
+    added = pack_folder(opt.folder, opt.archive)
+    print('Added {} checkpoints to {}'.format(len(added), opt.archive))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import torch.utils.data
+import torch.utils.data.dataset
+
+'''
+    Datasets used by the training and evaluation scripts, all normalized to [-1, 1]
+    torchvision is only imported when a dataset or transform is created
+'''
+
+DATASETS = ['mnist', 'anime', 'portrait', 'custom', 'ciphar10']
+
+# number of color channels per dataset
+CHANNELS = {'mnist': 1, 'anime': 3, 'portrait': 3, 'custom': 3, 'ciphar10': 3}
+
+_FOLDERS = {'anime': 'faces', 'portrait': 'portrait', 'custom': 'custom'}
+
+
+def get_transform(name, image_size):
+    import torchvision.transforms as transforms
+
+    if name == 'mnist':
+        return transforms.Compose(
+            [
+                transforms.Resize(image_size),
+                transforms.ToTensor(),
+                transforms.Normalize((0.5,), (0.5,)),
+            ]
+        )
+    if name == 'ciphar10':
+        return transforms.Compose(
+            [
+                transforms.Resize(image_size),
+                transforms.ToTensor(),
+                transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+            ]
+        )
+    return transforms.Compose(
+        [
+            transforms.Resize((image_size, image_size)),
+            transforms.ToTensor(),
+            transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
+        ]
+    )
+
+
+def load_dataset(name, image_size=64, root='dataset', train=True, split=False):
+    """
+    :param name: one of DATASETS
+    :param image_size: images are resized to image_size x image_size
+    :param root: folder containing the datasets
+    :param train: use the training set, otherwise the test set
+    :param split: image folder datasets have no test set, if set they are split 80/20 into train and test set
+    """
+    import torchvision.datasets as datasets
+    import utils.ciphar10 as ciphar10
+
+    if name not in DATASETS:
+        raise ValueError('Unknown dataset {}, expected one of {}'.format(name, ', '.join(DATASETS)))
+    transform = get_transform(name, image_size)
+
+    if name == 'mnist':
+        return datasets.MNIST(root=os.path.join(root, 'MNIST'), train=train, download=True, transform=transform)
+    if name == 'ciphar10':
+        return ciphar10.CIFAR10(root=os.path.join(root, 'cifar10'), train=train, download=True, transform=transform)
+
+    dataset = datasets.ImageFolder(root=os.path.join(root, _FOLDERS[name]), transform=transform)
+    if split:
+        border = int(len(dataset) * 0.8) + 1
+        idx = np.arange(0, border, 1) if train else np.arange(border, len(dataset), 1)
+        dataset = torch.utils.data.dataset.Subset(dataset, idx)
+    return dataset
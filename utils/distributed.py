@@ -0,0 +1,98 @@
+import os
+
+import torch
+import torch.distributed as dist
+from torch.utils.data.distributed import DistributedSampler
+
+'''
+    Multi-process data parallel training, on the cpu with the gloo backend. Processes are started with torchrun,
+    on one machine
+        torchrun --nproc_per_node 4 DRAGANcanonical.py ...
+    or on several machines
+        torchrun --nnodes 2 --node_rank 0 --master_addr host0 --master_port 29500 --nproc_per_node 2 DRAGANcanonical.py ...
+    Every process trains on its own share of each epoch with a batch of batchSize, gradients and batch norm
+    statistics are averaged over all processes. Without torchrun everything runs in a single process.
+'''
+
+
+def init(backend='gloo', threads=None):
+    """
+    Join the process group if the script was started by torchrun and split the cpus of the machine between
+    its processes, torchrun itself limits every process to one thread.
+    :param threads: intra-op threads per process, default cpus / processes on this machine
+    :return: (rank, world size)
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size == 1:
+        return 0, 1
+    dist.init_process_group(backend)
+    torch.set_num_threads(threads or max(1, (os.cpu_count() or 1) // local_world_size()))
+    # the default seed is the same in every process, the noise of the processes has to differ
+    torch.manual_seed(torch.initial_seed() + dist.get_rank())
+    return dist.get_rank(), dist.get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def local_world_size():
+    """
+    Number of processes on this machine
+    """
+    return int(os.environ.get('LOCAL_WORLD_SIZE', os.environ.get('WORLD_SIZE', 1)))
+
+
+def broadcast(obj, src=0):
+    """
+    obj of process src in every process, e.g. a random seed that all processes have to share
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src)
+    return objects[0]
+
+
+def all_reduce_mean(values):
+    """
+    Mean of a list of numbers over all processes, for logging
+    """
+    if not is_distributed():
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64, device='cpu')
+    dist.all_reduce(tensor)
+    return (tensor / dist.get_world_size()).tolist()
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+class ResumableDistributedSampler(DistributedSampler):
+    """
+    DistributedSampler that can continue an epoch at any position after a restart, like
+    utils.checkpoint.ResumableRandomSampler. All processes have to use the same seed.
+    __len__ always reports the full share of the process, so len(dataloader) stays the number of batches per epoch.
+    """
+
+    def __init__(self, data_source, seed=0, num_replicas=None, rank=None):
+        super(ResumableDistributedSampler, self).__init__(data_source, num_replicas=num_replicas, rank=rank,
+                                                          shuffle=True, seed=seed)
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        """
+        :param epoch: epoch to draw the permutation for
+        :param start: number of samples of this process' share that were already seen
+        """
+        super(ResumableDistributedSampler, self).set_epoch(epoch)
+        self.start = start
+
+    def __iter__(self):
+        return iter(list(super(ResumableDistributedSampler, self).__iter__())[self.start:])
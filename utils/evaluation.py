@@ -0,0 +1,174 @@
+import json
+import multiprocessing
+import os
+
+import torch
+
+'''
+    Runs a metric over many checkpoint epochs in a pool of worker processes.
+    Results are appended to a json lines file as they arrive, so an interrupted sweep
+    continues where it stopped. Once all epochs are done the file is rewritten in epoch order.
+    The first line of the file holds the config of the metric, results of a different config are never continued.
+'''
+
+
+class Metric:
+    """
+    Base class for metric plugins.
+    A metric is pickled to the worker processes before setup() is called, so everything
+    expensive (networks, datasets, checkpoints) should be created in setup().
+    """
+
+    name = 'metric'
+
+    def prepare(self):
+        """
+        Called once in the main process before any worker is started
+        """
+        pass
+
+    def setup(self):
+        pass
+
+    def evaluate(self, epoch):
+        """
+        :return: json serializable result for epoch
+        """
+        raise NotImplementedError
+
+    def config(self):
+        """
+        Identifies the results of the metric, by default its class and the plain attributes set by the constructor.
+        Called before prepare() and setup().
+        :return: json serializable dict
+        """
+        arguments = {key: value for key, value in vars(self).items()
+                     if value is None or isinstance(value, (bool, int, float, str))}
+        return {'metric': type(self).__name__, 'arguments': arguments}
+
+    def summary(self, results):
+        """
+        :param results: list of (epoch, result) in epoch order
+        :return: printable summary of the sweep
+        """
+        return '\n'.join('Epoch {}: {}'.format(epoch, result) for epoch, result in results)
+
+
+_worker_metric = None
+_worker_error = None
+
+
+def _init_worker(metric, threads, pool=True):
+    global _worker_metric, _worker_error
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # inter-op threads can only be set once per process
+        pass
+    try:
+        metric.setup()
+    except Exception as e:
+        if not pool:
+            raise
+        # a failing initializer makes the pool respawn workers forever, report it with the first task instead
+        _worker_error = e
+    _worker_metric = metric
+
+
+def _evaluate(epoch):
+    if _worker_error is not None:
+        raise _worker_error
+    return epoch, _worker_metric.evaluate(epoch)
+
+
+def read_results(path, config=None):
+    """
+    Results of a (possibly interrupted) sweep as {epoch: result}
+    :param config: Metric.config() the results have to belong to, None reads them without checking
+    """
+    results = {}
+    if not os.path.isfile(path):
+        return results
+    file_config = None
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # last line of an interrupted run
+                continue
+            if 'config' in entry:
+                file_config = entry['config']
+            else:
+                results[entry['epoch']] = entry['result']
+    if config is not None and results and file_config != json.loads(json.dumps(config)):
+        raise ValueError('{} holds results of {}, not of {}. Remove it or use another result file'.format(
+            path, file_config, config))
+    return results
+
+
+def write_results(path, results, config):
+    """
+    Replace path with the config line and results in epoch order
+    """
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps({'config': config}) + '\n')
+        for epoch in sorted(results):
+            f.write(json.dumps({'epoch': epoch, 'result': results[epoch]}) + '\n')
+    os.replace(tmp_path, path)
+
+
+def evaluate_epochs(metric, epochs, result_file, workers=None, threads=None):
+    """
+    Evaluate metric for all epochs that are not in result_file yet.
+    :param metric: Metric instance
+    :param epochs: iterable of epochs
+    :param result_file: json lines file collecting the results
+    :param workers: number of worker processes, defaults to one per cpu (one if cuda is used)
+    :param threads: intra-op threads per worker, defaults to splitting the cpus between the workers
+    :return: list of (epoch, result) in epoch order
+    """
+    epochs = list(epochs)
+    config = metric.config()
+    results = read_results(result_file, config)
+    todo = [epoch for epoch in epochs if epoch not in results]
+    if len(results) > 0:
+        print('Found results for {} epochs in {}'.format(len(epochs) - len(todo), result_file))
+
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        workers = 1 if torch.cuda.is_available() else cpus
+    workers = max(1, min(workers, len(todo)))
+    if len(todo) > 0:
+        metric.prepare()
+    threads = threads or max(1, cpus // workers)
+
+    directory = os.path.dirname(result_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if not results:
+        # also drops a config line without results
+        write_results(result_file, results, config)
+
+    with open(result_file, 'a') as f:
+        def collect(epoch, result):
+            results[epoch] = result
+            f.write(json.dumps({'epoch': epoch, 'result': result}) + '\n')
+            f.flush()
+            print('[{}] Epoch {}: {}'.format(metric.name, epoch, result))
+
+        if workers == 1:
+            _init_worker(metric, threads, pool=False)
+            for epoch in todo:
+                collect(*_evaluate(epoch))
+        elif len(todo) > 0:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(workers, initializer=_init_worker, initargs=(metric, threads)) as pool:
+                for epoch, result in pool.imap_unordered(_evaluate, todo):
+                    collect(epoch, result)
+
+    write_results(result_file, results, config)
+    return [(epoch, results[epoch]) for epoch in epochs]
@@ -0,0 +1,69 @@
+import torch
+import torch.nn.functional as F
+
+import models._DRAGAN as dcgm
+from utils.datasets import get_transform
+from utils.metrics import get_device, load_state_dict
+
+'''
+    Relevance maps of a trained canonical discriminator
+'''
+
+
+def relevance(discriminator, images, flip=True, probability=False):
+    """
+    Relevance of images for the discriminator output
+    :param probability: also return the probability of each image, taken from the same forward pass
+    """
+    with torch.enable_grad():
+        # the first layer differentiates w.r.t. its input during relprop
+        _, prob = discriminator(images.detach().requires_grad_(), flip=flip)
+        relevance_map = discriminator.relprop(flip).detach()
+    if probability:
+        return relevance_map, prob.detach()
+    return relevance_map
+
+
+class Explainer:
+    """
+    Loads a DiscriminatorNetLessCheckerboardToCanonical checkpoint once, folds its batch norm layers into the
+    convolutions and computes relevance maps for batches of images.
+    """
+
+    def __init__(self, checkpoint, nc=3, ndf=128, alpha=1, image_size=64, padding=1, flip=True, device=None,
+                 memory_format=torch.contiguous_format):
+        """
+        :param memory_format: memory format of the discriminator, see utils.tuning
+        """
+        self.nc = nc
+        self.image_size = image_size
+        self.padding = padding
+        self.flip = flip
+        self.device = device or get_device()
+        self.transform = get_transform('mnist' if nc == 1 else 'anime', image_size)
+
+        self.discriminator = dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc=nc, alpha=alpha, ndf=ndf, ngpu=1)
+        state_dict = torch.load(checkpoint, map_location=self.device)
+        load_state_dict(self.discriminator, state_dict)
+        self.discriminator.to(self.device)
+        self.discriminator.passBatchNormParametersToConvolution()
+        self.discriminator.removeBatchNormLayers()
+        self.discriminator.to(memory_format=memory_format)
+        self.discriminator.eval()
+
+    def preprocess(self, image):
+        """
+        PIL image to a normalized nc x image_size x image_size tensor
+        """
+        return self.transform(image.convert('L' if self.nc == 1 else 'RGB'))
+
+    def explain(self, images):
+        """
+        :param images: batch of unpadded images in [-1, 1]
+        :return: relevance summed over the color channels (N x H x W) and the probability of each image
+        """
+        p = self.padding
+        images = F.pad(images.to(self.device), (p, p, p, p), mode='replicate')
+        relevance_map, probability = relevance(self.discriminator, images, self.flip, probability=True)
+        relevance_map = torch.sum(relevance_map, 1)[:, p:-p, p:-p]
+        return relevance_map, probability
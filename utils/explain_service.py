@@ -0,0 +1,267 @@
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import PIL.Image
+import torch
+
+import utils.tuning as tuning
+from utils.explain import Explainer
+from utils.utils import heatmap
+
+'''
+    Local HTTP service for relevance maps.
+        POST /explain?format=png|npy   body: png / jpeg image or a .npy float array (C x H x W in [-1, 1])
+        GET  /metrics                  request statistics as json
+        GET  /health
+    Concurrent requests are collected into micro batches, a batch is run as soon as it is full or the
+    oldest request in it has waited max_latency seconds.
+'''
+
+
+class _Request:
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.queue_time = 0.0
+        self.compute_time = 0.0
+        self.batch_size = 0
+
+
+class ServiceMetrics:
+    """
+    Thread safe request statistics
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.compute_time = 0.0
+        self.batch_sizes = {}
+
+    def record_batch(self, requests, compute_time, failed=False):
+        with self.lock:
+            self.batches += 1
+            self.requests += len(requests)
+            self.errors += len(requests) if failed else 0
+            self.compute_time += compute_time
+            self.batch_sizes[len(requests)] = self.batch_sizes.get(len(requests), 0) + 1
+            for request in requests:
+                self.queue_time += request.queue_time
+                self.max_queue_time = max(self.max_queue_time, request.queue_time)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / max(self.batches, 1),
+                'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                'mean_queue_time': self.queue_time / max(self.requests, 1),
+                'max_queue_time': self.max_queue_time,
+                'mean_batch_compute_time': self.compute_time / max(self.batches, 1),
+            }
+
+
+class MicroBatcher:
+    """
+    Collects single images from many threads and runs fn on batches of them in one worker thread
+    """
+
+    def __init__(self, fn, max_batch_size=16, max_latency=0.01, metrics=None):
+        """
+        :param fn: maps a batch tensor to a tuple of per-sample result tensors
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics or ServiceMetrics()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        """
+        Queue a single image and block until its batch has been computed
+        """
+        request = _Request(image)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].enqueued + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                # past the deadline only requests that are already waiting are added
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            # only images of the same shape can be stacked, others wait for the next batch
+            if request.image.shape != batch[0].image.shape:
+                self.queue.put(request)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            for request in batch:
+                request.queue_time = start - request.enqueued
+                request.batch_size = len(batch)
+
+            failed = False
+            try:
+                results = self.fn(torch.stack([request.image for request in batch]))
+                for i, request in enumerate(batch):
+                    request.result = tuple(result[i] for result in results)
+            except Exception as e:
+                failed = True
+                for request in batch:
+                    request.error = e
+
+            compute_time = time.perf_counter() - start
+            self.metrics.record_batch(batch, compute_time, failed)
+            for request in batch:
+                request.compute_time = compute_time
+                request.done.set()
+
+
+def relevance_png(relevance):
+    """
+    Relevance map colored with the heatmap color map of utils.utils
+    """
+    relevance = relevance.cpu().numpy()
+    scale = np.abs(relevance).max()
+    colored = heatmap(relevance / scale if scale > 0 else relevance)
+    buffer = io.BytesIO()
+    PIL.Image.fromarray((colored * 255).astype(np.uint8), 'RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def make_handler(explainer, batcher):
+
+    class ExplainHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/metrics':
+                self._send(200, json.dumps(batcher.metrics.snapshot()).encode(), 'application/json')
+            elif path == '/health':
+                self._send(200, b'ok', 'text/plain')
+            else:
+                self._send(404, b'not found', 'text/plain')
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/explain':
+                self._send(404, b'not found', 'text/plain')
+                return
+            response_format = parse_qs(url.query).get('format', ['png'])[0]
+            if response_format not in ('png', 'npy'):
+                self._send(400, b'format has to be png or npy', 'text/plain')
+                return
+
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                image = self._decode(body)
+            except Exception as e:
+                self._send(400, 'Could not read image: {}'.format(e).encode(), 'text/plain')
+                return
+
+            try:
+                request = batcher.submit(image)
+            except Exception as e:
+                self._send(500, str(e).encode(), 'text/plain')
+                return
+
+            relevance, probability = request.result
+            if response_format == 'png':
+                payload, content_type = relevance_png(relevance), 'image/png'
+            else:
+                buffer = io.BytesIO()
+                np.save(buffer, relevance.cpu().numpy().astype(np.float32))
+                payload, content_type = buffer.getvalue(), 'application/octet-stream'
+
+            self._send(200, payload, content_type, {
+                'X-Probability': '{:.6f}'.format(probability.item()),
+                'X-Queue-Time': '{:.6f}'.format(request.queue_time),
+                'X-Compute-Time': '{:.6f}'.format(request.compute_time),
+                'X-Batch-Size': str(request.batch_size),
+            })
+
+        def _decode(self, body):
+            if body[:6] == b'\x93NUMPY':
+                array = np.load(io.BytesIO(body), allow_pickle=False)
+                expected = (explainer.nc, explainer.image_size, explainer.image_size)
+                if array.shape != expected:
+                    raise ValueError('expected an array of shape {}, got {}'.format(expected, array.shape))
+                return torch.from_numpy(array.astype(np.float32))
+            return explainer.preprocess(PIL.Image.open(io.BytesIO(body)))
+
+        def _send(self, status, payload, content_type, headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ExplainHandler
+
+
+def serve(explainer, host='127.0.0.1', port=8080, max_batch_size=16, max_latency=0.01):
+    """
+    Create the server, call serve_forever() on the result to start it
+    """
+    batcher = MicroBatcher(explainer.explain, max_batch_size=max_batch_size, max_latency=max_latency)
+    return ThreadingHTTPServer((host, port), make_handler(explainer, batcher))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve relevance maps of a canonical discriminator')
+    parser.add_argument('--loadD', required=True, help='path to discriminator')
+    parser.add_argument('--nc', type=int, default=3)
+    parser.add_argument('--ndf', type=int, default=128)
+    parser.add_argument('--alpha', type=int, default=1)
+    parser.add_argument('--imageSize', type=int, default=64)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max_batch', type=int, default=16, help='maximum number of images per batch')
+    parser.add_argument('--max_latency', type=float, default=10, help='milliseconds a request waits for a batch')
+    opt = parser.parse_args()
+
+    profile = tuning.apply_profile('explain') if not torch.cuda.is_available() else None
+    explainer = Explainer(opt.loadD, nc=opt.nc, ndf=opt.ndf, alpha=opt.alpha, image_size=opt.imageSize,
+                          memory_format=tuning.memory_format(profile))
+    server = serve(explainer, opt.host, opt.port, opt.max_batch, opt.max_latency / 1000)
+    print('Serving relevance maps on http://{}:{}'.format(opt.host, opt.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,79 @@
+import torch
+
+'''
+    Process wide cache of the datasets, networks and checkpoints used by the evaluation metrics and the
+    lrpgan command line, so evaluations chained in one process load each of them only once.
+    Networks handed out by the factory are shared, users load the state dict they need before every use.
+'''
+
+
+class Factory:
+
+    def __init__(self):
+        self.cache = {}
+        # memory format of the explained discriminators, set from the cpu profile by lrpgan.py
+        self.memory_format = torch.contiguous_format
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        """
+        Cached create(), commands use it for objects the factory has no method for
+        """
+        if key in self.cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.cache[key] = create()
+        return self.cache[key]
+
+    def device(self):
+        from utils.metrics import get_device
+        return self.get(('device',), get_device)
+
+    def dataset(self, name, image_size=64, root='dataset', train=True, split=False):
+        """
+        utils.datasets.load_dataset, cached
+        """
+        from utils.datasets import load_dataset
+        return self.get(('dataset', name, image_size, root, train, split),
+                        lambda: load_dataset(name, image_size, root, train=train, split=split))
+
+    def classifier(self):
+        """
+        MNIST classifier used by the inception score and the Frechet distance
+        """
+        from utils.metrics import load_classifier
+        return self.get(('classifier',), lambda: load_classifier(self.device()))
+
+    def network(self, network, *args, **kwargs):
+        """
+        network(*args, **kwargs) on the device, one instance per network class and arguments
+        """
+        key = ('network', network, args, tuple(sorted(kwargs.items())))
+        return self.get(key, lambda: network(*args, **kwargs).to(self.device()))
+
+    def checkpoints(self, path):
+        """
+        Checkpoint folder or checkpoint archive
+        """
+        from utils.checkpoint_archive import open_checkpoints
+        return self.get(('checkpoints', path), lambda: open_checkpoints(path))
+
+    def state_dict(self, path):
+        """
+        Single checkpoint file loaded to the device
+        """
+        return self.get(('state_dict', path), lambda: torch.load(path, map_location=self.device()))
+
+    def explainer(self, checkpoint, nc=3, ndf=128, alpha=1, image_size=64, flip=True):
+        from utils.explain import Explainer
+        return self.get(('explainer', checkpoint, nc, ndf, alpha, image_size, flip),
+                        lambda: Explainer(checkpoint, nc=nc, ndf=ndf, alpha=alpha, image_size=image_size,
+                                          flip=flip, device=self.device(), memory_format=self.memory_format))
+
+    def clear(self):
+        self.cache.clear()
+
+
+factory = Factory()
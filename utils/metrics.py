@@ -0,0 +1,469 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.utils.data
+import torch.utils.data.dataset
+
+import models._DRAGAN as dcgm
+from models._MNIST import Net
+from utils.checkpoint import state_dict_fingerprint, write_checkpoint
+from utils.datasets import CHANNELS, get_transform, load_dataset
+from utils.evaluation import Metric
+from utils.factory import factory
+
+'''
+    Metric plugins for utils.evaluation.evaluate_epochs
+'''
+
+CLASSIFIER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'mnist_cnn.pt')
+# fewer images per split make p(y) the mean of a handful of p(y|x), the score then tends to 1 whatever the generator
+MIN_IMAGES_PER_SPLIT = 100
+
+
+def get_device():
+    return torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+
+def load_state_dict(module, state_dict, strict=True):
+    """
+    load_state_dict that drops the num_batches_tracked buffers unknown to torch 0.4.0
+    """
+    if torch.__version__ == '0.4.0':
+        state_dict = OrderedDict((key, value) for key, value in state_dict.items()
+                                 if not key.endswith('num_batches_tracked'))
+    module.load_state_dict(state_dict, strict=strict)
+    return module
+
+
+def load_classifier(device):
+    net = Net().to(device)
+    net.load_state_dict(torch.load(CLASSIFIER_PATH, map_location=device))
+    net.eval()
+    return net
+
+
+def inference_mode():
+    """
+    torch.inference_mode where available, torch.no_grad on older versions
+    """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+class SplitInceptionScore:
+    """
+    Streaming inception score over num_images samples divided into consecutive splits.
+    Per split only the sum of p(y|x) and the sum of p(y|x) log p(y|x) are kept, using
+        mean KL(p(y|x) || p(y)) = mean sum_y p(y|x) log p(y|x) - sum_y p(y) log p(y)
+    so memory does not depend on the number of images.
+    """
+
+    def __init__(self, num_images, num_classes=10, splits=10):
+        self.num_images = num_images
+        self.splits = max(1, min(splits, num_images))
+        self.sum_p = torch.zeros(self.splits, num_classes, dtype=torch.float64)
+        self.sum_plogp = torch.zeros(self.splits, dtype=torch.float64)
+        self.count = torch.zeros(self.splits, dtype=torch.float64)
+        self.seen = 0
+
+    def update(self, scores):
+        """
+        :param scores: classifier logits of the next batch of samples
+        """
+        log_p = F.log_softmax(scores.double(), dim=1).cpu()
+        p = log_p.exp()
+        index = torch.arange(self.seen, self.seen + p.size(0)) * self.splits // self.num_images
+        index = index.clamp(max=self.splits - 1)
+        self.sum_p.index_add_(0, index, p)
+        self.sum_plogp.index_add_(0, index, (p * log_p).sum(1))
+        self.count.index_add_(0, index, torch.ones(p.size(0), dtype=torch.float64))
+        self.seen += p.size(0)
+
+    def compute(self):
+        """
+        :return: mean and standard deviation of the score over the splits
+        """
+        count = self.count.clamp(min=1)
+        p_y = self.sum_p / count.unsqueeze(1)
+        entropy_y = torch.where(p_y > 0, p_y * p_y.clamp(min=1e-300).log(), torch.zeros_like(p_y)).sum(1)
+        scores = torch.exp(self.sum_plogp / count - entropy_y)[self.count > 0]
+        return scores.mean().item(), scores.std(unbiased=False).item()
+
+
+class InceptionScore(Metric):
+    """
+    Inception style score of MNIST generators, using the MNIST classifier instead of inception
+    """
+
+    name = 'inception'
+
+    def __init__(self, genfolder, num_images=10000, batch_size=500, splits=10, ngf=128, seed=1234):
+        if num_images // splits < MIN_IMAGES_PER_SPLIT:
+            raise ValueError('Inception score needs at least {} images per split, got {} images for {} splits'.format(
+                MIN_IMAGES_PER_SPLIT, num_images, splits))
+        self.genfolder = genfolder
+        self.num_images = num_images
+        self.batch_size = batch_size
+        self.splits = splits
+        self.ngf = ngf
+        self.seed = seed
+
+    def setup(self):
+        self.device = factory.device()
+        self.net = factory.classifier()
+        self.generator = factory.network(dcgm.GeneratorNetLessCheckerboard, 1, self.ngf, 1)
+        self.checkpoints = factory.checkpoints(self.genfolder)
+
+    def evaluate(self, epoch):
+        self.generator.load_state_dict(self.checkpoints.state_dict('generator_epoch_{}'.format(epoch)), strict=False)
+        generator = self.generator.inferenceGenerator()
+        torch.manual_seed(self.seed + epoch)
+
+        score = SplitInceptionScore(self.num_images, splits=self.splits)
+        with inference_mode():
+            for start in range(0, self.num_images, self.batch_size):
+                noise = torch.randn(min(self.batch_size, self.num_images - start), 100, 1, 1, device=self.device)
+                score.update(self.net(generator(noise)))
+
+        mean, std = score.compute()
+        return {'mean': mean, 'std': std}
+
+    def summary(self, results):
+        means = [result['mean'] for _, result in results]
+        best = int(np.argmax(means))
+        lines = ['Best score of the run was {} +- {} at epoch {}'.format(means[best], results[best][1]['std'],
+                                                                        results[best][0])]
+        lines += ['{} {}'.format(result['mean'], result['std']) for _, result in results]
+        return '\n'.join(lines)
+
+
+class FeatureStatistics:
+    """
+    Streaming mean and covariance of feature vectors in float64.
+    Every chunk is merged with the pairwise update of Chan et al., which avoids the
+    cancellation of the naive sum of squares.
+    """
+
+    def __init__(self, dim):
+        self.n = 0
+        self.mean = np.zeros(dim, dtype=np.float64)
+        self.m2 = np.zeros((dim, dim), dtype=np.float64)
+
+    def update(self, features):
+        features = features.detach().cpu().double().numpy()
+        n = features.shape[0]
+        if n == 0:
+            return
+        mean = features.mean(0)
+        centered = features - mean
+        delta = mean - self.mean
+        total = self.n + n
+        self.m2 += centered.T @ centered + np.outer(delta, delta) * (self.n * n / total)
+        self.mean += delta * (n / total)
+        self.n = total
+
+    def covariance(self):
+        return self.m2 / max(self.n - 1, 1)
+
+
+def symmetric_sqrt(matrix):
+    """
+    Square root of a symmetric positive semi-definite matrix via its eigendecomposition
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+    return (eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))) @ eigenvectors.T
+
+
+def frechet_distance(mu1, sqrt_sigma1, mu2, sigma2):
+    """
+    ||mu1 - mu2||^2 + tr(sigma1) + tr(sigma2) - 2 tr((sigma1 sigma2)^1/2)
+    sigma1 sigma2 is similar to the symmetric sqrt_sigma1 sigma2 sqrt_sigma1, so the trace term is the
+    sum of the square roots of its eigenvalues and only needs one symmetric eigenvalue solve.
+    :param sqrt_sigma1: symmetric_sqrt of the first covariance, precomputed for the cached statistics
+    """
+    product = sqrt_sigma1 @ sigma2 @ sqrt_sigma1
+    trace_sqrt = np.sqrt(np.clip(np.linalg.eigvalsh((product + product.T) / 2), 0, None)).sum()
+    diff = mu1 - mu2
+    return float(diff @ diff + np.trace(sqrt_sigma1 @ sqrt_sigma1) + np.trace(sigma2) - 2 * trace_sqrt)
+
+
+def real_statistics(dataset, image_size=64, root='../dataset', batch_size=500, cache_dir=None, device=None):
+    """
+    Classifier feature statistics of a dataset, computed once and cached on disk.
+    The cache key covers the dataset, its transform and the classifier weights.
+    :return: dict with mu, sigma, sqrt_sigma and n
+    """
+    device = device or get_device()
+    key = hashlib.sha1()
+    key.update('{} {} {}'.format(dataset, image_size, get_transform(dataset, image_size)).encode())
+    with open(CLASSIFIER_PATH, 'rb') as f:
+        key.update(f.read())
+    cache_dir = cache_dir or os.path.join(root, 'fid_statistics')
+    path = os.path.join(cache_dir, '{}_{}.npz'.format(dataset, key.hexdigest()[:16]))
+
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    net = load_classifier(device)
+    loader = torch.utils.data.DataLoader(load_dataset(dataset, image_size, root), batch_size=batch_size,
+                                         shuffle=False, num_workers=0)
+    statistics = FeatureStatistics(net.fc1.out_features)
+    with inference_mode():
+        for batch_data, _ in loader:
+            statistics.update(net.features(batch_data.to(device)))
+
+    sigma = statistics.covariance()
+    result = {'mu': statistics.mean, 'sigma': sigma, 'sqrt_sigma': symmetric_sqrt(sigma), 'n': statistics.n}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, '.{}'.format(os.path.basename(path)))
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **result)
+    os.replace(tmp_path, path)
+    return result
+
+
+class FrechetDistance(Metric):
+    """
+    Frechet distance between the fc1 features of generated MNIST digits and the MNIST training set
+    """
+
+    name = 'fid'
+
+    def __init__(self, genfolder, num_images=10000, batch_size=500, dataset='mnist', root='../dataset',
+                 ngf=128, seed=1234):
+        self.genfolder = genfolder
+        self.num_images = num_images
+        self.batch_size = batch_size
+        self.dataset = dataset
+        self.root = root
+        self.ngf = ngf
+        self.seed = seed
+
+    def prepare(self):
+        # fill the cache before the workers start, so they do not all compute it
+        real_statistics(self.dataset, root=self.root, batch_size=self.batch_size)
+
+    def setup(self):
+        self.device = factory.device()
+        self.net = factory.classifier()
+        self.real = real_statistics(self.dataset, root=self.root, batch_size=self.batch_size, device=self.device)
+        self.generator = factory.network(dcgm.GeneratorNetLessCheckerboard, 1, self.ngf, 1)
+        self.checkpoints = factory.checkpoints(self.genfolder)
+
+    def evaluate(self, epoch):
+        self.generator.load_state_dict(self.checkpoints.state_dict('generator_epoch_{}'.format(epoch)), strict=False)
+        generator = self.generator.inferenceGenerator()
+        torch.manual_seed(self.seed + epoch)
+
+        statistics = FeatureStatistics(self.net.fc1.out_features)
+        with inference_mode():
+            for start in range(0, self.num_images, self.batch_size):
+                noise = torch.randn(min(self.batch_size, self.num_images - start), 100, 1, 1, device=self.device)
+                statistics.update(self.net.features(generator(noise)))
+
+        return frechet_distance(self.real['mu'], self.real['sqrt_sigma'], statistics.mean, statistics.covariance())
+
+    def summary(self, results):
+        distances = [distance for _, distance in results]
+        best = int(np.argmin(distances))
+        lines = ['Best distance of the run was {} at epoch {}'.format(distances[best], results[best][0])]
+        lines += [str(distance) for distance in distances]
+        return '\n'.join(lines)
+
+
+def stabilize_batch_norm(net, inputs):
+    """
+    Recompute the running statistics of all batch norm layers of net as the plain average over inputs
+    (momentum None), instead of the exponential average left over from training.
+    :return: the recomputed buffers
+    """
+    layers = [module for module in net.modules() if isinstance(module, nn.modules.batchnorm._BatchNorm)]
+    momenta = [layer.momentum for layer in layers]
+    for layer in layers:
+        layer.reset_running_stats()
+        layer.momentum = None
+
+    net.train()
+    with torch.no_grad():
+        for x in inputs:
+            net(x)
+    net.eval()
+
+    for layer, momentum in zip(layers, momenta):
+        layer.momentum = momentum
+    return batch_norm_buffers(net)
+
+
+def batch_norm_buffers(net):
+    return OrderedDict((name, buffer.detach().clone()) for name, buffer in net.named_buffers()
+                       if name.rsplit('.', 1)[-1] in ('running_mean', 'running_var', 'num_batches_tracked'))
+
+
+class Confusion(Metric):
+    """
+    Counts how many real test images and generated images the discriminator classifies correctly.
+    Before counting, the batch norm statistics of both networks are recomputed over a fixed subset of
+    stabilize_batches batches. The recomputed statistics are cached per checkpoint in cache_dir.
+    """
+
+    name = 'confusion'
+
+    def __init__(self, genfolder_g, genfolder_d, dataset, root='../dataset', batch_size=64, noise_batch_size=128,
+                 ngf=128, ndf=128, alpha=1, seed=1234, stabilize_batches=20, cache_dir=None):
+        self.genfolder_g = genfolder_g
+        self.genfolder_d = genfolder_d
+        self.dataset = dataset
+        self.root = root
+        self.batch_size = batch_size
+        self.noise_batch_size = noise_batch_size
+        self.ngf = ngf
+        self.ndf = ndf
+        self.alpha = alpha
+        self.seed = seed
+        self.stabilize_batches = stabilize_batches
+        self.cache_dir = cache_dir
+
+    def setup(self):
+        self.device = factory.device()
+        nc = CHANNELS[self.dataset]
+        dataset = factory.dataset(self.dataset, 64, self.root, train=False, split=True)
+        self.dataloader = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
+                                                      shuffle=False, num_workers=0)
+
+        # the subset used for the batch norm statistics is the same for all epochs
+        generator = torch.Generator()
+        generator.manual_seed(self.seed)
+        subset = torch.randperm(len(dataset), generator=generator)
+        if self.stabilize_batches is not None:
+            subset = subset[:self.stabilize_batches * self.batch_size]
+        self.stabilize_loader = torch.utils.data.DataLoader(
+            torch.utils.data.dataset.Subset(dataset, subset.tolist()), batch_size=self.batch_size,
+            shuffle=False, num_workers=0)
+
+        self.generator = factory.network(dcgm.GeneratorNetLessCheckerboardUpsample, nc, ngf=self.ngf, ngpu=1)
+        self.discriminator = factory.network(dcgm.DiscriminatorNetLessCheckerboardToCanonical, nc=nc,
+                                             alpha=self.alpha, ndf=self.ndf, ngpu=1)
+        self.checkpoints_g = factory.checkpoints(self.genfolder_g)
+        self.checkpoints_d = factory.checkpoints(self.genfolder_d)
+
+    def _stabilize(self, discriminator, generator, state_dict_d, state_dict_g):
+        path = None
+        if self.cache_dir is not None:
+            # everything the recomputed statistics depend on: both checkpoints, the real images and the noise
+            key = hashlib.sha1('{} {} {} {} {} {} {} {}'.format(
+                state_dict_fingerprint(state_dict_d), state_dict_fingerprint(state_dict_g), self.stabilize_batches,
+                self.batch_size, self.noise_batch_size, self.seed, self.dataset,
+                os.path.abspath(self.root)).encode()).hexdigest()
+            path = os.path.join(self.cache_dir, 'bn_{}.pth'.format(key))
+            if os.path.isfile(path):
+                buffers = torch.load(path, map_location=self.device)
+                load_state_dict(discriminator, buffers['discriminator'], strict=False)
+                load_state_dict(generator, buffers['generator'], strict=False)
+                return
+
+        p = 1
+        buffers = {'discriminator': stabilize_batch_norm(
+            discriminator,
+            (F.pad(batch_data, (p, p, p, p), mode='replicate').to(self.device)
+             for batch_data, _ in self.stabilize_loader))}
+
+        noise_generator = torch.Generator(device=self.device)
+        noise_generator.manual_seed(self.seed)
+        buffers['generator'] = stabilize_batch_norm(
+            generator,
+            (torch.randn(self.noise_batch_size, 100, 1, 1, device=self.device, generator=noise_generator)
+             for _ in range(len(self.stabilize_loader))))
+
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_checkpoint(buffers, path)
+
+    def evaluate(self, epoch):
+        p = 1
+        state_dict_d = self.checkpoints_d.state_dict('discriminator_epoch_{}'.format(epoch))
+        state_dict_g = self.checkpoints_g.state_dict('generator_epoch_{}'.format(epoch))
+        discriminator = load_state_dict(self.discriminator, state_dict_d)
+        generator = load_state_dict(self.generator, state_dict_g)
+
+        self._stabilize(discriminator, generator, state_dict_d, state_dict_g)
+        discriminator.eval()
+        generator = generator.inferenceGenerator()
+        torch.manual_seed(self.seed + epoch)
+
+        # counters stay on the device, so there is no synchronisation per batch
+        counts = torch.zeros(4, dtype=torch.long, device=self.device)
+        with inference_mode():
+            for batch_data, _ in self.dataloader:
+                batch_data = F.pad(batch_data, (p, p, p, p), mode='replicate').to(self.device)
+                probs = discriminator.score(batch_data)
+
+                noise = torch.randn(batch_data.size(0), 100, 1, 1, device=self.device)
+                images = F.pad(generator(noise), (p, p, p, p), mode='replicate')
+                fake_probs = discriminator.score(images)
+
+                counts += torch.stack(((probs > 0.5).sum(), (probs < 0.5).sum(),
+                                       (fake_probs > 0.5).sum(), (fake_probs < 0.5).sum()))
+
+        true_positive, false_negative, false_positive, true_negative = counts.tolist()
+        return {'TP': true_positive, 'FN': false_negative, 'FP': false_positive, 'TN': true_negative}
+
+    def summary(self, results):
+        lines = ['TP, FN, FP, TN ']
+        lines += ['{} {} {} {}'.format(r['TP'], r['FN'], r['FP'], r['TN']) for _, r in results]
+        return '\n'.join(lines)
+
+
+class SampleGrid(Metric):
+    """
+    Saves a grid of generated samples for every epoch
+    """
+
+    name = 'samples'
+
+    def __init__(self, genfolder, outf, num_images=9, nc=3, ngf=128, seed=1234):
+        self.genfolder = genfolder
+        self.outf = outf
+        self.num_images = num_images
+        self.nc = nc
+        self.ngf = ngf
+        self.seed = seed
+
+    def setup(self):
+        self.device = factory.device()
+        self.generator = factory.network(dcgm.GeneratorNetLessCheckerboard, self.nc, ngf=self.ngf, ngpu=1)
+        self.checkpoints = factory.checkpoints(self.genfolder)
+
+    def evaluate(self, epoch):
+        from matplotlib import pyplot as plt
+        import torchvision.utils as vutils
+        plt.switch_backend('agg')
+
+        torch.manual_seed(self.seed + epoch)
+        noise = torch.randn(self.num_images, 100, 1, 1, device=self.device)
+        try:
+            state_dict = self.checkpoints.state_dict('generator_epoch_{}'.format(epoch))
+        except (RuntimeError, KeyError):
+            print('Epoch {} checkpoint is missing or corrupted, skipping'.format(epoch))
+            return None
+        generator = load_state_dict(self.generator, state_dict).inferenceGenerator()
+
+        images = generator(noise)
+
+        grid = vutils.make_grid(images.detach().cpu(), normalize=True, nrow=int(np.sqrt(self.num_images)))
+        fig = plt.figure(figsize=(64, 64), facecolor='white')
+        plt.imshow(np.moveaxis(grid.numpy(), 0, -1))
+        ax = plt.axes()
+        ax.xaxis.set_visible(False)
+        ax.yaxis.set_visible(False)
+        plt.axis('off')
+        path = '{}/fake_samples_epoch_{}.pdf'.format(self.outf, epoch)
+        fig.savefig(path, dpi=100, bbox_inches='tight', pad_inches=0)
+        plt.close()
+        return path
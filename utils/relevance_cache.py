@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+try:
+    import fcntl
+except ImportError:
+    # no lock on windows
+    fcntl = None
+
+'''
+    Content addressed on-disk cache for relevance maps.
+    Maps are stored as float16 in memory mapped shard files, one group of shards per map shape:
+        <directory>/<shape>_<shard>.f16     slots of identical shape
+        <directory>/<shape>_<shard>.key     sha1 key of the map in every slot
+        <directory>/index.json              key -> shape, shard, slot, scale in least recently used order
+        <directory>/lock                    held by the process using the cache
+    The index is only written by flush(), so after a crash it can point to slots that were reused since.
+    get() therefore compares the key stored with the slot and treats a mismatch as a miss.
+    Relevance values are tiny compared to the float16 range, so every map is divided by its maximum
+    absolute value before it is stored and the scale is kept in the index.
+'''
+
+
+def tensor_digest(tensor):
+    digest = hashlib.sha1('{} {}'.format(tensor.dtype, list(tensor.shape)).encode())
+    digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def rule_config(discriminator, flip):
+    """
+    Everything besides the weights that changes the relevance: alpha and epsilon of all layers and flip
+    """
+    config = ['flip={}'.format(flip)]
+    for name, module in discriminator.named_modules():
+        for attribute in ('alpha', 'beta', 'epsilon'):
+            if hasattr(module, attribute):
+                config.append('{}.{}={}'.format(name, attribute, getattr(module, attribute)))
+    return ' '.join(config)
+
+
+class RelevanceCache:
+    """
+    LRU cache of relevance maps under a size budget
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30, shard_slots=1024):
+        """
+        :param max_bytes: budget for the stored maps, least recently used maps are evicted beyond it
+        :param shard_slots: number of maps per shard file
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.shard_slots = shard_slots
+        self.entries = OrderedDict()
+        self.shards = {}
+        self.free = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = open(os.path.join(directory, 'lock'), 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.lock.close()
+                raise RuntimeError('Relevance cache {} is used by another process'.format(directory))
+
+        index_path = os.path.join(directory, 'index.json')
+        if os.path.isfile(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            self.shard_slots = index['shard_slots']
+            for key, shape, shard, slot, scale in index['entries']:
+                self.entries[key] = (tuple(shape), shard, slot, scale)
+                self.size += self._nbytes(shape)
+
+    @staticmethod
+    def key(image, fingerprint, config):
+        """
+        :param image: single input tensor
+        :param fingerprint: fingerprint of the checkpoint, see utils.checkpoint.state_dict_fingerprint
+        :param config: rule configuration, see rule_config
+        """
+        return hashlib.sha1('{} {} {}'.format(tensor_digest(image), fingerprint, config).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :return: float32 relevance map or None
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        shape, shard, slot, scale = self.entries[key]
+        if self._shard(shape, shard, 'key')[slot].tobytes() != bytes.fromhex(key):
+            # the slot was reused after the index was last written
+            del self.entries[key]
+            self.size -= self._nbytes(shape)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return torch.from_numpy(np.array(self._shard(shape, shard)[slot], dtype=np.float32) * scale)
+
+    def put(self, key, relevance):
+        relevance = relevance.detach().cpu().double().numpy()
+        shape = tuple(relevance.shape)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        if self._nbytes(shape) > self.max_bytes:
+            return
+
+        while self.size + self._nbytes(shape) > self.max_bytes:
+            self._evict()
+
+        scale = float(np.abs(relevance).max()) or 1.0
+        shard, slot = self._allocate(shape)
+        # the slot's old key is cleared before its map is overwritten, so it is never read under the old key
+        keys = self._shard(shape, shard, 'key')
+        keys[slot] = 0
+        self._shard(shape, shard)[slot] = (relevance / scale).astype(np.float16)
+        keys[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        self.entries[key] = (shape, shard, slot, scale)
+        self.size += self._nbytes(shape)
+
+    def relevance(self, images, fingerprint, config, compute):
+        """
+        Relevance of a batch of images, only the images that are not cached are passed to compute
+        :param compute: maps a batch of images to their relevance
+        """
+        keys = [self.key(image, fingerprint, config) for image in images]
+        cached = [self.get(key) for key in keys]
+        missing = [i for i, relevance in enumerate(cached) if relevance is None]
+        if missing:
+            computed = compute(images[missing])
+            for i, relevance in zip(missing, computed):
+                self.put(keys[i], relevance)
+                cached[i] = relevance.detach().cpu().float()
+        return torch.stack(cached).to(images.device)
+
+    def flush(self):
+        for shard in self.shards.values():
+            shard.flush()
+        index_path = os.path.join(self.directory, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'shard_slots': self.shard_slots,
+                       'entries': [(key, list(shape), shard, slot, scale)
+                                   for key, (shape, shard, slot, scale) in self.entries.items()]}, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def close(self):
+        """
+        Flush and release the lock of the cache directory
+        """
+        self.flush()
+        self.lock.close()
+
+    def _evict(self):
+        key, (shape, shard, slot, _) = self.entries.popitem(last=False)
+        self.free.setdefault(shape, []).append((shard, slot))
+        self.size -= self._nbytes(shape)
+
+    def _allocate(self, shape):
+        if shape not in self.free:
+            # slots that are not used by any entry of the index can be reused
+            used = {(shard, slot) for s, shard, slot, _ in self.entries.values() if s == shape}
+            shards = max([shard for shard, _ in used] + [-1]) + 1
+            self.free[shape] = sorted(((shard, slot) for shard in range(shards) for slot in range(self.shard_slots)
+                                       if (shard, slot) not in used), reverse=True)
+        if not self.free[shape]:
+            shard = 1 + max([shard for s, shard, _, _ in self.entries.values() if s == shape] + [-1])
+            self.free[shape] = [(shard, slot) for slot in reversed(range(self.shard_slots))]
+        return self.free[shape].pop()
+
+    def _shard(self, shape, shard, kind='f16'):
+        """
+        :param kind: f16 for the maps, key for the sha1 keys of the slots
+        """
+        if (shape, shard, kind) not in self.shards:
+            path = os.path.join(self.directory, '{}_{}.{}'.format('x'.join(str(s) for s in shape), shard, kind))
+            mode = 'r+' if os.path.isfile(path) else 'w+'
+            dtype, item_shape = (np.float16, tuple(shape)) if kind == 'f16' else (np.uint8, (20,))
+            self.shards[(shape, shard, kind)] = np.memmap(path, dtype=dtype, mode=mode,
+                                                          shape=(self.shard_slots,) + item_shape)
+        return self.shards[(shape, shard, kind)]
+
+    @staticmethod
+    def _nbytes(shape):
+        return int(np.prod(shape)) * 2
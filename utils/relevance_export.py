@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+
+from utils.checkpoint import state_dict_fingerprint
+from utils.datasets import CHANNELS, DATASETS, load_dataset
+from utils.evaluation import Metric, evaluate_epochs, read_results, write_results
+from utils.explain import Explainer
+
+'''
+    Exports images, probabilities and relevance maps of a whole dataset into compressed shards.
+        <out>/shard_<i>.npz     indices, labels, images (float16), probability, relevance (summed colors)
+        <out>/index.jsonl       config of the export, then one line per finished shard
+        <out>/export.json       dataset and checkpoint the shards belong to
+    Shards are written by a pool of processes, an interrupted export continues with the missing shards.
+'''
+
+
+class RelevanceExport(Metric):
+    """
+    Computes one shard per evaluate() call
+    """
+
+    name = 'export'
+
+    def __init__(self, out, checkpoint, dataset, root='dataset', train=True, shard_size=1024, batch_size=64,
+                 ndf=128, alpha=1, flip=True):
+        self.out = out
+        self.checkpoint = checkpoint
+        self.dataset = dataset
+        self.root = root
+        self.train = train
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        self.ndf = ndf
+        self.alpha = alpha
+        self.flip = flip
+
+    def setup(self):
+        self.data = load_dataset(self.dataset, 64, self.root, train=self.train, split=True)
+        self.explainer = Explainer(self.checkpoint, nc=CHANNELS[self.dataset], ndf=self.ndf, alpha=self.alpha,
+                                   flip=self.flip)
+
+    def num_shards(self):
+        return (len(self.data) + self.shard_size - 1) // self.shard_size
+
+    def evaluate(self, shard):
+        indices = np.arange(shard * self.shard_size, min((shard + 1) * self.shard_size, len(self.data)))
+        images, labels, probabilities, relevances = [], [], [], []
+        for start in range(0, len(indices), self.batch_size):
+            batch = [self.data[int(i)] for i in indices[start:start + self.batch_size]]
+            batch_images = torch.stack([image for image, _ in batch])
+            relevance, probability = self.explainer.explain(batch_images)
+            images.append(batch_images.numpy().astype(np.float16))
+            labels.append(np.array([label for _, label in batch], dtype=np.int64))
+            probabilities.append(probability.cpu().numpy().astype(np.float32))
+            relevances.append(relevance.cpu().numpy().astype(np.float32))
+
+        name = 'shard_{:05d}.npz'.format(shard)
+        tmp_path = os.path.join(self.out, '.{}'.format(name))
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, indices=indices, labels=np.concatenate(labels), images=np.concatenate(images),
+                                probability=np.concatenate(probabilities), relevance=np.concatenate(relevances))
+        os.replace(tmp_path, os.path.join(self.out, name))
+        return {'file': name, 'count': len(indices)}
+
+    def summary(self, results):
+        return 'Exported {} images in {} shards to {}'.format(sum(result['count'] for _, result in results),
+                                                              len(results), self.out)
+
+
+def read_shards(out):
+    """
+    Stream the shards of an export in index order
+    :return: generator of dicts with indices, labels, images, probability and relevance
+    """
+    results = read_results(os.path.join(out, 'index.jsonl'))
+    for shard in sorted(results):
+        with np.load(os.path.join(out, results[shard]['file'])) as data:
+            yield {key: data[key] for key in data.files}
+
+
+def export(export_metric, workers=None, threads=None):
+    os.makedirs(export_metric.out, exist_ok=True)
+    export_metric.setup()
+
+    description = {'dataset': export_metric.dataset, 'train': export_metric.train,
+                   'shard_size': export_metric.shard_size, 'flip': export_metric.flip,
+                   'checkpoint': state_dict_fingerprint(export_metric.explainer.discriminator.state_dict())}
+    description_path = os.path.join(export_metric.out, 'export.json')
+    if os.path.isfile(description_path):
+        with open(description_path) as f:
+            previous = json.load(f)
+        if previous != description:
+            raise ValueError('{} contains an export of {}, not of {}'.format(export_metric.out, previous, description))
+    else:
+        with open(description_path, 'w') as f:
+            json.dump(description, f)
+
+    # finished shards whose file went missing are computed again
+    index_path = os.path.join(export_metric.out, 'index.jsonl')
+    config = export_metric.config()
+    results = read_results(index_path, config)
+    if any(not os.path.isfile(os.path.join(export_metric.out, result['file'])) for result in results.values()):
+        write_results(index_path, {shard: result for shard, result in results.items()
+                                   if os.path.isfile(os.path.join(export_metric.out, result['file']))}, config)
+
+    shards = range(export_metric.num_shards())
+    # the workers load the dataset and network themselves
+    del export_metric.data, export_metric.explainer
+    return evaluate_epochs(export_metric, shards, index_path, workers=workers, threads=threads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export relevance maps of a dataset into shards')
+    parser.add_argument('--dataset', required=True, choices=DATASETS)
+    parser.add_argument('--dataset_root', default='dataset')
+    parser.add_argument('--test', action='store_true', help='export the test set instead of the training set')
+    parser.add_argument('--loadD', required=True, help='path to discriminator')
+    parser.add_argument('--ndf', type=int, default=128)
+    parser.add_argument('--alpha', type=int, default=1)
+    parser.add_argument('--no_flip', action='store_true', help='do not flip the last layer for relevance propagation')
+    parser.add_argument('--outf', required=True, help='folder for the shards')
+    parser.add_argument('--shard_size', type=int, default=1024, help='images per shard')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, default one per cpu')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads per process')
+    opt = parser.parse_args()
+
+    metric = RelevanceExport(opt.outf, opt.loadD, opt.dataset, root=opt.dataset_root, train=not opt.test,
+                             shard_size=opt.shard_size, batch_size=opt.batch_size, ndf=opt.ndf, alpha=opt.alpha,
+                             flip=not opt.no_flip)
+    print(metric.summary(export(metric, workers=opt.workers, threads=opt.threads)))
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import PIL.Image
+import torch
+
+import models._DRAGAN as dcgm
+from utils.metrics import get_device, load_state_dict
+
+'''
+    Streaming sample generation for evaluation sets of many thousand images.
+    Samples are generated in fixed size chunks without autograd, noise chunk i is drawn from a generator
+    seeded with seed + i, so the same seed and chunk size always give the same images.
+    Images are written as uint8 either to
+        <out>/<index>.png               one file per image, encoded in a thread pool
+        <out>                           .npy file with a num_images x H x W x C array, written as memory map
+    Only a bounded number of chunks is kept in memory at a time.
+'''
+
+GENERATORS = {
+    'upsample': dcgm.GeneratorNetLessCheckerboardUpsample,
+    'lesscheckerboard': dcgm.GeneratorNetLessCheckerboard,
+    'lrp': dcgm.LRPGeneratorNet,
+    'dcgan': dcgm.Generator,
+}
+
+
+def to_uint8(images):
+    """
+    N x C x H x W images in [-1, 1] to a N x H x W x C uint8 array, single channel images keep C = 1
+    """
+    images = ((images.detach() + 1) * 127.5).round_().clamp_(0, 255).to(torch.uint8)
+    return images.permute(0, 2, 3, 1).cpu().numpy()
+
+
+class PNGWriter:
+    """
+    Encodes chunks of uint8 images to png files in a thread pool
+    """
+
+    def __init__(self, directory, workers=4, max_pending=None):
+        """
+        :param max_pending: chunks that may wait for encoding before write blocks, default 2 * workers
+        """
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending or 2 * workers
+        self.pending = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, start, images):
+        self.pending = [future for future in self.pending if not future.done()]
+        while len(self.pending) >= self.max_pending:
+            # keeps the memory bounded when encoding is slower than sampling
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self._save, start, images))
+
+    def _save(self, start, images):
+        for i, image in enumerate(images):
+            PIL.Image.fromarray(image[:, :, 0] if image.shape[2] == 1 else image).save(
+                os.path.join(self.directory, '{:06d}.png'.format(start + i)))
+
+    def close(self):
+        for future in self.pending:
+            # re-raise errors of the background writes
+            future.result()
+        self.executor.shutdown()
+
+
+class MemmapWriter:
+    """
+    Writes chunks of uint8 images into a num_images x H x W x C .npy file opened as memory map
+    """
+
+    def __init__(self, path, num_images, shape):
+        """
+        :param shape: H x W x C of a single image
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.array = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(num_images,) + tuple(shape))
+
+    def write(self, start, images):
+        self.array[start:start + len(images)] = images
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+def stream_samples(generator, num_images, writer=None, chunk_size=256, nz=100, seed=1234, device=None,
+                   callback=None):
+    """
+    Generate num_images samples chunk by chunk
+    :param generator: generator with inferenceGenerator(), or any module that is used as it is
+    :param writer: PNGWriter, MemmapWriter or None, closed by the caller
+    :param callback: called with (start, images) for every chunk of generated images on the device
+    :return: number of generated images
+    """
+    device = device or next(generator.parameters()).device
+    if hasattr(generator, 'inferenceGenerator'):
+        generator = generator.inferenceGenerator()
+    generator.eval()
+
+    noise_generator = torch.Generator(device=device)
+    with torch.no_grad():
+        for chunk, start in enumerate(range(0, num_images, chunk_size)):
+            noise_generator.manual_seed(seed + chunk)
+            noise = torch.randn(min(chunk_size, num_images - start), nz, 1, 1, device=device,
+                                generator=noise_generator)
+            images = generator(noise)
+            if callback is not None:
+                callback(start, images)
+            if writer is not None:
+                writer.write(start, to_uint8(images))
+    return num_images
+
+
+def add_arguments(parser):
+    parser.add_argument('--loadG', required=True, help='path to generator')
+    parser.add_argument('--generator', default='upsample', choices=sorted(GENERATORS))
+    parser.add_argument('--nc', type=int, default=3)
+    parser.add_argument('--ngf', type=int, default=128)
+    parser.add_argument('--nz', type=int, default=100)
+    parser.add_argument('--num_images', type=int, required=True)
+    parser.add_argument('--chunk_size', type=int, default=256, help='images generated at once')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--format', default='png', choices=['png', 'memmap'])
+    parser.add_argument('--out', required=True, help='folder for png files or path of the .npy memory map')
+    parser.add_argument('--workers', type=int, default=4, help='png encoding threads')
+
+
+def write_samples(generator, opt):
+    """
+    Write the samples of a loaded generator as configured by the arguments of add_arguments
+    """
+    device = next(generator.parameters()).device
+    if opt.format == 'png':
+        writer = PNGWriter(opt.out, workers=opt.workers)
+    else:
+        with torch.no_grad():
+            sample = generator.inferenceGenerator()(torch.zeros(1, opt.nz, 1, 1, device=device))
+        writer = MemmapWriter(opt.out, opt.num_images, to_uint8(sample).shape[1:])
+    stream_samples(generator, opt.num_images, writer, chunk_size=opt.chunk_size, nz=opt.nz, seed=opt.seed,
+                   device=device)
+    writer.close()
+    with open(os.path.join(opt.out, 'samples.json') if opt.format == 'png' else opt.out + '.json', 'w') as f:
+        json.dump(vars(opt), f)
+    print('Wrote {} samples to {}'.format(opt.num_images, opt.out))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write generated samples to png files or a uint8 memory map')
+    add_arguments(parser)
+    opt = parser.parse_args()
+
+    device = get_device()
+    generator = GENERATORS[opt.generator](opt.nc, opt.ngf, 1).to(device)
+    load_state_dict(generator, torch.load(opt.loadG, map_location=device), strict=False)
+    generator.eval()
+    write_samples(generator, opt)
@@ -0,0 +1,227 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import torch
+import torch.nn.functional as F
+
+'''
+    Cpu execution profile of this machine: intra-op and inter-op threads, oneDNN (mkldnn) on or off and the
+    memory format of the networks. python -m utils.tuning times a DRAGAN training step and a relevance map batch
+    under every configuration, each in a fresh interpreter because inter-op threads can only be set once per
+    process, and stores the fastest configuration per workload for this machine in
+        benchmarks/cpu_profile.json     {machine: {workload: {"config": {...}, "seconds": ...}}}
+    The training and evaluation scripts call apply_profile at startup, without a profile nothing changes.
+'''
+
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks',
+                            'cpu_profile.json')
+
+WORKLOADS = ['train', 'explain']
+
+
+def machine():
+    """
+    Key of this machine in the profile, a profile is only valid for the cpu and torch build it was measured with
+    """
+    return '{} {} cpus torch {}'.format(platform.node(), os.cpu_count(), torch.__version__)
+
+
+def configurations(threads=None, interop_threads=(1, 2)):
+    """
+    :param threads: intra-op thread counts, default all cpus, half and a quarter of them
+    """
+    cpus = os.cpu_count() or 1
+    threads = threads or sorted({cpus, max(1, cpus // 2), max(1, cpus // 4)}, reverse=True)
+    return [{'threads': t, 'interop_threads': i, 'channels_last': c, 'mkldnn': m}
+            for t, i, c, m in itertools.product(threads, interop_threads, (False, True), (True, False))]
+
+
+def memory_format(config):
+    return torch.channels_last if config and config['channels_last'] else torch.contiguous_format
+
+
+def configure(config, processes=1):
+    """
+    Set threads and oneDNN of this process
+    :param processes: processes sharing the machine, e.g. torchrun workers, split the threads between them
+    """
+    torch.set_num_threads(max(1, config['threads'] // processes))
+    try:
+        torch.set_num_interop_threads(config['interop_threads'])
+    except RuntimeError:
+        # inter-op threads can only be set before the first inter-op parallel work
+        pass
+    torch.backends.mkldnn.enabled = config['mkldnn']
+
+
+def load_profile(path=None):
+    path = path or PROFILE_PATH
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_profile(workload, *modules, processes=1, path=None):
+    """
+    Configure this process with the profile of workload for this machine and convert modules to its memory format
+    :return: the applied configuration, None if this machine has no profile
+    """
+    entry = load_profile(path).get(machine(), {}).get(workload)
+    if entry is None:
+        return None
+    config = entry['config']
+    configure(config, processes)
+    for module in modules:
+        module.to(memory_format=memory_format(config))
+    print('Cpu profile {}: {}'.format(workload, config))
+    return config
+
+
+def train_step(batch_size=64, ngf=64, ndf=64, nc=3):
+    """
+    One discriminator and one generator update of DRAGANcanonical.py
+    :return: (function running the step, networks)
+    """
+    import models._DRAGAN as dcgm
+
+    generator = dcgm.GeneratorNetLessCheckerboardUpsample(nc, ngf, 1)
+    discriminator = dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc, ndf, 1, 1)
+    d_optimizer = torch.optim.Adam(discriminator.parameters(), lr=0.0002, betas=(0.5, 0.999))
+    g_optimizer = torch.optim.Adam(generator.parameters(), lr=0.0002, betas=(0.5, 0.999))
+    real = F.pad(torch.rand(batch_size, nc, 64, 64) * 2 - 1, (1, 1, 1, 1), mode='replicate')
+    ones, zeros = torch.ones(batch_size), torch.zeros(batch_size)
+
+    def step():
+        discriminator.zero_grad()
+        F.binary_cross_entropy(discriminator(real), ones).backward()
+        fake = F.pad(generator(torch.randn(batch_size, 100, 1, 1)), (1, 1, 1, 1), mode='replicate')
+        F.binary_cross_entropy(discriminator(fake.detach()), zeros).backward()
+        d_optimizer.step()
+
+        generator.zero_grad()
+        fake = F.pad(generator(torch.randn(batch_size, 100, 1, 1)), (1, 1, 1, 1), mode='replicate')
+        F.binary_cross_entropy(discriminator(fake), ones).backward()
+        g_optimizer.step()
+
+    return step, (generator, discriminator)
+
+
+def explain_step(batch_size=16, ndf=128, nc=3):
+    """
+    Relevance maps of a batch with the canonical discriminator, as utils.explain.Explainer computes them
+    """
+    import models._DRAGAN as dcgm
+    from utils.explain import relevance
+
+    discriminator = dcgm.DiscriminatorNetLessCheckerboardToCanonical(nc=nc, alpha=1, ndf=ndf, ngpu=1)
+    discriminator.passBatchNormParametersToConvolution()
+    discriminator.removeBatchNormLayers()
+    discriminator.eval()
+    images = F.pad(torch.rand(batch_size, nc, 64, 64) * 2 - 1, (1, 1, 1, 1), mode='replicate')
+    return lambda: relevance(discriminator, images), (discriminator,)
+
+
+STEPS = {'train': train_step, 'explain': explain_step}
+
+
+def measure_config(workload, config, repeat=3, batch_size=None):
+    """
+    Seconds per step of workload with config, configures the calling process
+    """
+    from utils.benchmark import measure
+
+    configure(config)
+    torch.manual_seed(1234)
+    step, modules = STEPS[workload](**({'batch_size': batch_size} if batch_size else {}))
+    for module in modules:
+        module.to(memory_format=memory_format(config))
+    return measure(step, repeat=repeat, warmup=1)['median']
+
+
+def measure_subprocess(workload, config, repeat=3, batch_size=None):
+    """
+    Seconds per step of workload with config, measured in a fresh interpreter whose errors go to stderr
+    :return: None if the measurement failed, e.g. because the configuration is not supported by this torch build
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-m', 'utils.tuning', '--measure', json.dumps(config), '--workloads', workload,
+               '--repeat', str(repeat)]
+    if batch_size:
+        command += ['--batch_size', str(batch_size)]
+    try:
+        output = subprocess.check_output(command, cwd=root, env=dict(os.environ, PYTHONPATH=root))
+        return float(output.decode().strip().splitlines()[-1])
+    except (subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+
+
+def tune(workloads=WORKLOADS, configs=None, repeat=3, batch_size=None, path=None):
+    """
+    Time every configuration for every workload and store the fastest ones for this machine
+    Configurations that fail are reported and skipped.
+    :return: {workload: {"config": ..., "seconds": ...}}, workloads without a working configuration are left out
+    """
+    configs = configs or configurations()
+    best = {}
+    failed = []
+    for workload in workloads:
+        for config in configs:
+            seconds = measure_subprocess(workload, config, repeat, batch_size)
+            print('{:<8} threads {:>3} interop {:>2} channels_last {:<5} mkldnn {:<5} {:>10}'.format(
+                workload, config['threads'], config['interop_threads'], str(config['channels_last']),
+                str(config['mkldnn']), 'failed' if seconds is None else '{:.1f} ms'.format(seconds * 1000)))
+            sys.stdout.flush()
+            if seconds is None:
+                failed.append((workload, config))
+            elif workload not in best or seconds < best[workload]['seconds']:
+                best[workload] = {'config': config, 'seconds': seconds}
+
+    for workload, config in failed:
+        print('Skipped failing configuration of {}: {}'.format(workload, config))
+    for workload in workloads:
+        if workload not in best:
+            print('No working configuration for {}, its profile is left unchanged'.format(workload))
+
+    path = path or PROFILE_PATH
+    profile = load_profile(path)
+    profile.setdefault(machine(), {}).update(best)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(profile, f, indent=1)
+    os.replace(path + '.tmp', path)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the fastest cpu configuration of this machine')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help='comma separated workloads to tune')
+    parser.add_argument('--threads', default=None, help='comma separated intra-op thread counts to try')
+    parser.add_argument('--interop_threads', default='1,2', help='comma separated inter-op thread counts to try')
+    parser.add_argument('--repeat', type=int, default=3, help='timed steps per configuration, the median is used')
+    parser.add_argument('--batch_size', type=int, default=None, help='default 64 for train, 16 for explain')
+    parser.add_argument('--profile', default=None, help='profile file, default benchmarks/cpu_profile.json')
+    parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+    opt = parser.parse_args()
+
+    if opt.measure:
+        # single measurement in a fresh interpreter, started by measure_subprocess
+        print(measure_config(opt.workloads, json.loads(opt.measure), opt.repeat, opt.batch_size))
+        return
+
+    configs = configurations([int(t) for t in opt.threads.split(',')] if opt.threads else None,
+                             [int(t) for t in opt.interop_threads.split(',')])
+    best = tune(opt.workloads.split(','), configs, opt.repeat, opt.batch_size, opt.profile)
+    for workload, entry in best.items():
+        print('Best {}: {} ({:.1f} ms)'.format(workload, entry['config'], entry['seconds'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,45 @@
 import os
 import sys
 import shutil
+import importlib
 import numpy as np
 import errno
-import torchvision.utils as vutils
-from tensorboardX import SummaryWriter
-from IPython import display
-from matplotlib import pyplot as plt
-import matplotlib
-import matplotlib.colors as colors
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import colorednoise as cn
-
-import math
 import torch
-import torch.nn.functional as F
-from torch.autograd import Variable
-from torchvision.models import inception_v3
 
-if torch.cuda.is_available():
-    plt.switch_backend('agg')
-import PIL, PIL.Image
+'''
+    Matplotlib, tensorboardX, IPython and torchvision are imported on first use, so scripts that only need
+    the color maps, noise or box drawing start without them. Time the imports with tests/BenchmarkImports.py
+'''
+
+
+class _LazyModule:
+    """
+    Imports the module on the first attribute access, on_import is called with the module once
+    """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._on_import is not None:
+                self._on_import(module)
+            self._module = module
+        return getattr(self._module, attribute)
+
+
+def _configure_pyplot(pyplot):
+    if torch.cuda.is_available():
+        pyplot.switch_backend('agg')
+
+
+plt = _LazyModule('matplotlib.pyplot', _configure_pyplot)
+colors = _LazyModule('matplotlib.colors')
+display = _LazyModule('IPython.display')
+vutils = _LazyModule('torchvision.utils')
 
 '''
     TensorBoard Data will be stored in './runs' path
@@ -47,6 +66,7 @@ class Logger:
             Logger._make_fresh_dir(out_dir)
 
         # TensorBoard
+        from tensorboardX import SummaryWriter
         self.writer = SummaryWriter(log_dir=self.log_subdir, comment=self.comment)
 
     def log(self, d_error, g_error, epoch, n_batch, num_batches, d_real, d_fake_1, d_fake_2):
@@ -66,6 +86,16 @@ class Logger:
         self.writer.add_scalar('{}/prediction_fake_1'.format(self.comment), d_fake_1, step)
         self.writer.add_scalar('{}/prediction_fake_2'.format(self.comment), d_fake_2, step)
 
+    def log_relprop_profile(self, profiler, epoch, n_batch, num_batches):
+        """
+        Write the per layer summary of a modules.RelevanceInstrumentation.RelpropProfiler as scalars
+        """
+        step = Logger._step(epoch, n_batch, num_batches)
+        for layer, values in profiler.summary().items():
+            for column, value in values.items():
+                if value is not None:
+                    self.writer.add_scalar('{}/relprop/{}/{}'.format(self.comment, layer, column), value, step)
+
     def log_images(self, images, relevance, num_images, epoch, n_batch, num_batches,
                    printdata, format='NCHW', normalize=True, noLabel=False):
         """
@@ -476,12 +506,44 @@ def visualize(x, colormap):
     # PIL.Image.fromarray((x * 255).astype('byte'), 'RGB').save('./data/images/VGAN/MNIST/' + name)
 
 
-def pink_noise(batch_size, channels, width, height):
-    samples = batch_size * channels * width * height
-    pink_noise = cn.powerlaw_psd_gaussian(1, batch_size * channels * width * height)
-    pink_noise = torch.from_numpy(pink_noise)
-    pink_noise = pink_noise.reshape(batch_size, channels, width, height).float()
-    return pink_noise
+_spectral_filters = {}
+
+
+def _spectral_filter(width, height, exponent, device):
+    """
+    Amplitudes f^(-exponent / 2) of the rfft2 half spectrum and the standard deviation of the noise they produce
+    """
+    key = (width, height, exponent, str(device))
+    if key not in _spectral_filters:
+        fx = torch.fft.fftfreq(width, device=device).reshape(-1, 1)
+        fy = torch.fft.rfftfreq(height, device=device).reshape(1, -1)
+        # frequencies below the lowest one (the mean) get the amplitude of the lowest frequency
+        f = torch.sqrt(fx ** 2 + fy ** 2).clamp(min=1. / max(width, height))
+        amplitude = f ** (-exponent / 2.)
+
+        # E ||irfft2(amplitude * (a + ib))||^2 per bin with a, b ~ N(0, 1) and norm='ortho':
+        # 4 for bins with a conjugate partner outside the half spectrum, 1 for bins in the first and the
+        # Nyquist column, whose imaginary part is dropped
+        weight = torch.full_like(amplitude, 4.)
+        weight[:, 0] = 1
+        if height % 2 == 0:
+            weight[:, -1] = 1
+        std = torch.sqrt((amplitude ** 2 * weight).sum() / (width * height))
+        _spectral_filters[key] = (amplitude, std)
+    return _spectral_filters[key]
+
+
+def pink_noise(batch_size, channels, width, height, device=None, exponent=1, generator=None):
+    """
+    Gaussian noise with a 2d 1/f^exponent power spectrum and unit variance, every channel of every image
+    is an independent field. The spectral filter is cached per shape and device, a batch takes a single
+    inverse FFT.
+    """
+    amplitude, std = _spectral_filter(width, height, exponent, device)
+    spectrum = torch.randn((batch_size, channels) + tuple(amplitude.shape) + (2,), device=device,
+                           generator=generator)
+    spectrum = torch.view_as_complex(spectrum) * (amplitude / std)
+    return torch.fft.irfft2(spectrum, s=(width, height), norm='ortho')
 
 
 def drawBoxes(data, add=False, background_fill=-1, *argv):
@@ -498,7 +560,8 @@ def drawBoxes(data, add=False, background_fill=-1, *argv):
             elif arg[1] == 'uniform':
                 fill = torch.ones(batch_size, channels, arg[0][1][0] - arg[0][0][0], arg[0][1][1] - arg[0][0][1]).uniform_(-1, 1)
             elif arg[1] == 'pink':
-                fill = pink_noise(batch_size, channels, arg[0][1][0] - arg[0][0][0], arg[0][1][1] - arg[0][0][1])
+                fill = pink_noise(batch_size, channels, arg[0][1][0] - arg[0][0][0], arg[0][1][1] - arg[0][0][1],
+                                  device=data.device)
         else:
             fill = torch.zeros([batch_size, channels, imageSize, imageSize]).fill_(background_fill)
 
@@ -510,22 +573,34 @@ def drawBoxes(data, add=False, background_fill=-1, *argv):
     return data
 
 
-# set the colormap and centre the colorbar
-class MidpointNormalize(colors.Normalize):
-    """
-    Normalise the colorbar so that diverging bars work there way either side from a prescribed midpoint value)
-    e.g. im=ax1.imshow(array, norm=MidpointNormalize(midpoint=0.,vmin=-100, vmax=100))
-    """
+def _midpoint_normalize():
+
+    # set the colormap and centre the colorbar
+    class MidpointNormalize(colors.Normalize):
+        """
+        Normalise the colorbar so that diverging bars work there way either side from a prescribed midpoint value)
+        e.g. im=ax1.imshow(array, norm=MidpointNormalize(midpoint=0.,vmin=-100, vmax=100))
+        """
+
+        def __init__(self, vmin=None, vmax=None, midpoint=None, clip=False):
+            self.midpoint = midpoint
+            colors.Normalize.__init__(self, vmin, vmax, clip)
+
+        def __call__(self, value, clip=None):
+            # I'm ignoring masked values and all kinds of edge cases to make a
+            # simple example...
+            x, y = [self.vmin, self.midpoint, self.vmax], [0, 0.5, 1]
+            return np.ma.masked_array(np.interp(value, x, y), np.isnan(value))
+
+    return MidpointNormalize
 
-    def __init__(self, vmin=None, vmax=None, midpoint=None, clip=False):
-        self.midpoint = midpoint
-        colors.Normalize.__init__(self, vmin, vmax, clip)
 
-    def __call__(self, value, clip=None):
-        # I'm ignoring masked values and all kinds of edge cases to make a
-        # simple example...
-        x, y = [self.vmin, self.midpoint, self.vmax], [0, 0.5, 1]
-        return np.ma.masked_array(np.interp(value, x, y), np.isnan(value))
+def __getattr__(name):
+    # MidpointNormalize subclasses a matplotlib class, it is only created when it is imported
+    if name == 'MidpointNormalize':
+        globals()[name] = _midpoint_normalize()
+        return globals()[name]
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
 
 
 # net = inception_v3(pretrained=True)